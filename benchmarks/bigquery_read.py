@@ -0,0 +1,50 @@
+"""Compares reading query results through the REST API and the fast path of the Storage Read API
+
+Usage:
+    GCP_PROJECT=my-project python benchmarks/bigquery_read.py "SELECT * FROM dataset.table" --max-streams 8
+
+Each path runs the same query; the query cache of BigQuery is used after the first run,
+so the timings are dominated by downloading and converting the result.
+The default path of get_df_from_query also uses the Storage Read API when it is installed.
+"""
+import argparse
+import time
+
+from megaton_data import bigquery
+
+
+def measure(label: str, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    if hasattr(result, 'memory_usage'):
+        rows, size = len(result), result.memory_usage(deep=True).sum()
+    else:
+        rows, size = result.num_rows, result.nbytes
+    print(f"{label:<28} {elapsed:8.2f} s {rows:>12,} rows {size / 1024 / 1024:10.1f} MB")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('query')
+    parser.add_argument('--max-streams', type=int, default=None)
+    args = parser.parse_args()
+
+    # warm up the clients and the query cache
+    bigquery.run_query(args.query)
+
+    rest = measure("REST (tabledata.list)", lambda: bigquery.run_query(args.query).to_dataframe(
+        create_bqstorage_client=False))
+    measure("default (to_dataframe)", lambda: bigquery.get_df_from_query(args.query))
+    fast = measure("Storage Read API", lambda: bigquery.get_df_from_query(
+        args.query, fast=True, max_streams=args.max_streams))
+    measure("Storage Read API, compact", lambda: bigquery.get_df_from_query(
+        args.query, fast=True, max_streams=args.max_streams, compact=True))
+    measure("Storage Read API, arrow", lambda: bigquery.get_df_from_query(
+        args.query, fast=True, max_streams=args.max_streams, as_arrow=True))
+    print(f"speed-up: {rest / fast:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,25 @@
 """Common helper BigQuery functions"""
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from datetime import date, datetime
+from decimal import Decimal
+import hashlib
+import json
 import os
+import re
+import threading
+import time
+import uuid
 from logging import basicConfig, DEBUG, INFO, WARNING
 
 from google.api_core import retry
 from google.cloud import bigquery
+import numpy as np
+import pandas as pd
+import pyarrow as pa
 
-from . import log
+from . import errors, log
 
 PROJECT_ID = os.getenv("GCP_PROJECT")
 logger = log.Logger(__name__)
@@ -15,6 +28,10 @@ logger.setLevel(INFO)
 # Reuse GCP Clients across function invocations using globals
 # https://cloud.google.com/functions/docs/bestpractices/tips#use_global_variables_to_reuse_objects_in_future_invocations
 BQ_CLIENT = None
+BQS_CLIENT = None
+
+# bytes a query may process unless maximum_bytes_billed is given. no limit if None
+MAXIMUM_BYTES_BILLED = None
 
 
 def lazy_client() -> bigquery.Client:
@@ -29,18 +46,743 @@ def lazy_client() -> bigquery.Client:
     return BQ_CLIENT
 
 
-def get_df_from_query(query: str):
-    rows_iterable = run_query(query)
-    df = rows_iterable.to_dataframe()
-    logger.info(f"{len(df)} rows were retrieved.")
+def lazy_read_client():
+    """
+    Return a BigQuery Storage Read Client that may be shared between cloud function
+    invocations.
+    """
+    global BQS_CLIENT
+    if not BQS_CLIENT:
+        # google-cloud-bigquery-storage is needed only for the fast path
+        from google.cloud import bigquery_storage
+        BQS_CLIENT = bigquery_storage.BigQueryReadClient()
+    return BQS_CLIENT
+
+
+# functions whose results change between runs. BigQuery does not cache queries using them.
+# CURRENT_DATE etc. may be called without parentheses
+NON_DETERMINISTIC = re.compile(r'\bCURRENT_(DATE|DATETIME|TIME|TIMESTAMP)\b(?!\s*\.)'
+                               r'|\b(RAND|GENERATE_UUID|SESSION_USER)\s*\(', re.IGNORECASE)
+
+
+class QueryCache(object):
+    """Caches query results keyed by the normalized SQL, the parameters and
+    the last modified time of every table the query references.
+
+    Results are kept in memory (LRU) and optionally in Parquet files on disk for ttl seconds.
+    Building a key costs a dry run and a get_table call per table, but no query slots.
+    Like the cache of BigQuery, queries that reference no tables or use non-deterministic
+    functions such as CURRENT_DATE() are not cached.
+
+    Args:
+        max_entries (int): number of results kept in memory
+        path (str): directory for the Parquet files. disk tier is disabled if None
+        ttl (int): seconds a result stays valid
+    """
+
+    def __init__(self, max_entries: int = 32, path: str = None, ttl: int = 86400):
+        self.max_entries = max_entries
+        self.path = path
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """Collapses whitespace outside of string literals and quoted identifiers"""
+        parts = re.split(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)""", query.strip())
+        return ''.join(p if i % 2 else re.sub(r'\s+', ' ', p) for i, p in enumerate(parts))
+
+    def key(self, query: str, params: list = None, variant: str = '') -> str:
+        """Builds the key of a query, or returns None if the result must not be cached.
+        The tables are looked up with a dry run
+
+        Args:
+            variant (str): what else the result depends on, such as the read path
+        """
+        match = NON_DETERMINISTIC.search(query)
+        if match:
+            logger.debug(f"The result is not cached as the query uses {match.group(0).strip()}.")
+            return None
+        bq_client = lazy_client()
+        job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+        if params:
+            job_config.query_parameters = params
+        dry_run = bq_client.query(query, job_config=job_config)
+        if not dry_run.referenced_tables:
+            logger.debug("The result is not cached as the query references no tables.")
+            return None
+        modified = sorted(
+            f"{ref.project}.{ref.dataset_id}.{ref.table_id}@{bq_client.get_table(ref).modified.isoformat()}"
+            for ref in dry_run.referenced_tables
+        )
+        params_repr = [p.to_api_repr() for p in params] if params else []
+        source = json.dumps([self.normalize(query), params_repr, modified, variant], sort_keys=True, default=str)
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> pd.DataFrame:
+        """Gets a copy of the cached result, or None"""
+        with self._lock:
+            if key in self._entries:
+                cached_at, df = self._entries[key]
+                if time.time() - cached_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    return df.copy()
+                del self._entries[key]
+        if self.path:
+            file_path = os.path.join(self.path, f"{key}.parquet")
+            if os.path.exists(file_path) and time.time() - os.path.getmtime(file_path) < self.ttl:
+                df = pd.read_parquet(file_path)
+                self._remember(key, df, cached_at=os.path.getmtime(file_path))
+                return df.copy()
+        return None
+
+    def set(self, key: str, df: pd.DataFrame):
+        self._remember(key, df.copy())
+        if self.path:
+            try:
+                df.to_parquet(os.path.join(self.path, f"{key}.parquet"), index=False)
+            except (ValueError, TypeError, pa.ArrowException) as e:
+                logger.warning(f"The result cannot be cached on disk: {e}")
 
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, key: str, df: pd.DataFrame, cached_at: float = None):
+        with self._lock:
+            self._entries[key] = (cached_at or time.time(), df)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+# Query results shared within the process. use_cache=True in get_df_from_query
+QUERY_CACHE = QueryCache()
+
+# arrow -> nullable pandas types, as the REST path returns. plain int64 becomes float64 with NULLs
+_PANDAS_TYPES = {
+    pa.int8(): pd.Int8Dtype(),
+    pa.int16(): pd.Int16Dtype(),
+    pa.int32(): pd.Int32Dtype(),
+    pa.int64(): pd.Int64Dtype(),
+    pa.bool_(): pd.BooleanDtype(),
+    pa.string(): pd.StringDtype(),
+    pa.large_string(): pd.StringDtype(),
+}
+
+
+def get_df_from_query(query: str, fast: bool = False, max_streams: int = None, as_arrow: bool = False,
+                      compact: bool = False, use_cache: bool = False, cache: QueryCache = None,
+                      params: dict = None, maximum_bytes_billed: int = None, ordered: bool = None):
+    """Runs a query and returns the result
+
+    By default the client library downloads the result, through the Storage Read API if
+    google-cloud-bigquery-storage is installed or the REST API otherwise.
+
+    Args:
+        query (str): SQL
+        fast (bool): if True, the streams of the Storage Read API are controlled here (max_streams),
+            the arrow table can be returned as is, and integers, booleans and strings are converted
+            to nullable dtypes with low peak memory
+        max_streams (int): max number of streams for the fast path. decided by BigQuery if None
+        ordered (bool): whether the fast path must keep the order of rows. see read_query_arrow
+        as_arrow (bool): if True, a pyarrow.Table is returned (fast path only)
+        compact (bool): if True, integers are downcast and repetitive strings become categorical
+        use_cache (bool): if True, the result is cached (DataFrame only). see QueryCache
+        cache (QueryCache): cache to use instead of QUERY_CACHE
+        params (dict): named query parameters. see run_query
+        maximum_bytes_billed (int): bytes the query may process. see run_query
+    Returns:
+        pd.DataFrame or pyarrow.Table
+    """
+    key = None
+    if (use_cache or cache) and not as_arrow:
+        cache = cache or QUERY_CACHE
+        key = cache.key(query, build_query_parameters(params), variant='fast' if fast else 'rest')
+        df = cache.get(key) if key else None
+        if df is not None:
+            logger.info(f"{len(df)} rows were retrieved from cache.")
+            return compact_dtypes(df) if compact else df
+
+    if fast:
+        table = read_query_arrow(query, max_streams=max_streams, params=params,
+                                 maximum_bytes_billed=maximum_bytes_billed, ordered=ordered)
+        logger.info(f"{table.num_rows} rows were retrieved.")
+        if as_arrow:
+            return table
+        # release arrow buffers while converting to keep the peak memory low
+        df = table.to_pandas(split_blocks=True, self_destruct=True, types_mapper=_PANDAS_TYPES.get)
+        del table
+    else:
+        rows_iterable = run_query(query, params=params, maximum_bytes_billed=maximum_bytes_billed)
+        df = rows_iterable.to_dataframe()
+        logger.info(f"{len(df)} rows were retrieved.")
+
+    if key:
+        cache.set(key, df)
+    if compact:
+        df = compact_dtypes(df)
     return df
 
 
-def run_query(query: str):
+def read_query_arrow(query: str, max_streams: int = None, params: dict = None,
+                     maximum_bytes_billed: int = None, ordered: bool = None) -> pa.Table:
+    """Runs a query and reads the result table in parallel streams with the Storage Read API
+
+    Streams return rows in no particular order, so an ordered result is read in one stream.
+
+    Args:
+        ordered (bool): whether the order of rows must be kept.
+            if None, the query is ordered when it ends with ORDER BY outside of parentheses
+    """
     bq_client = lazy_client()
+    query_job = submit_query(query, params=params, maximum_bytes_billed=maximum_bytes_billed)
+    rows = query_job.result()
+    destination = query_job.destination
+    if ordered is None:
+        ordered = has_final_order_by(query)
+    if ordered:
+        max_streams = 1
+
+    from google.cloud.bigquery_storage import types
+    read_client = lazy_read_client()
+    session = read_client.create_read_session(
+        parent=f"projects/{bq_client.project}",
+        read_session=types.ReadSession(
+            table=f"projects/{destination.project}/datasets/{destination.dataset_id}/tables/{destination.table_id}",
+            data_format=types.DataFormat.ARROW,
+        ),
+        max_stream_count=max_streams or 0,
+    )
+    if not session.streams:
+        # no rows
+        return rows.to_arrow()
+
+    def read(stream) -> pa.Table:
+        return read_client.read_rows(stream.name).to_arrow(session)
+
+    logger.debug(f"Reading {destination.table_id} in {len(session.streams)} streams")
+    with ThreadPoolExecutor(max_workers=len(session.streams)) as executor:
+        tables = list(executor.map(read, session.streams))
+    return pa.concat_tables(tables)
+
+
+def has_final_order_by(query: str) -> bool:
+    """Whether the query orders its result: ORDER BY outside of parentheses, string literals and comments.
+    ORDER BY in subqueries and window functions (OVER (ORDER BY ...)) does not count
+    """
+    parts = re.split(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)""", query)
+    depth = 0
+    top_level = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            # literal or quoted identifier
+            continue
+        part = re.sub(r'--[^\n]*|#[^\n]*|/\*.*?\*/', ' ', part, flags=re.DOTALL)
+        for token in re.split(r'([()])', part):
+            if token == '(':
+                depth += 1
+            elif token == ')':
+                depth -= 1
+            elif depth == 0:
+                top_level.append(token)
+    return bool(re.search(r'\bORDER\s+BY\b', ' '.join(top_level), re.IGNORECASE))
+
+
+def compact_dtypes(df: pd.DataFrame, category_ratio: float = 0.5) -> pd.DataFrame:
+    """Downcasts integer columns and converts repetitive string columns to categorical.
+    Floats are kept as they are to keep their precision.
+
+    Args:
+        category_ratio (float): strings become categorical if unique values / rows is below this
+    """
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_bool_dtype(series):
+            continue
+        if pd.api.types.is_integer_dtype(series):
+            # nullable Int64 is downcast to Int8, Int16 or Int32
+            df[col] = pd.to_numeric(series, downcast='integer')
+        elif pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series):
+            try:
+                if len(series) and series.nunique() / len(series) < category_ratio:
+                    df[col] = series.astype('category')
+            except TypeError:
+                # unhashable values such as arrays of REPEATED fields
+                pass
+    return df
+
+
+def iter_query_batches(query: str, batch_size: int = 10000, as_arrow: bool = False, params: dict = None,
+                       maximum_bytes_billed: int = None):
+    """Runs a query and yields the result in batches of batch_size rows as pages arrive
+
+    Only the current page and one batch are held in memory. The last batch may be smaller.
+
+    Args:
+        query (str): SQL
+        batch_size (int): rows per batch
+        as_arrow (bool): if True, pyarrow.RecordBatch is yielded instead of pd.DataFrame
+    """
+    rows = run_query(query, page_size=batch_size, params=params, maximum_bytes_billed=maximum_bytes_billed)
+    if as_arrow:
+        pages = rows.to_arrow_iterable()
+    else:
+        pages = rows.to_dataframe_iterable()
+
+    buffer = []
+    count = 0
+    for page in pages:
+        buffer.append(page)
+        count += len(page)
+        while count >= batch_size:
+            merged = _concat_pages(buffer, as_arrow)
+            yield merged[:batch_size] if as_arrow else merged.iloc[:batch_size].reset_index(drop=True)
+            rest = merged[batch_size:] if as_arrow else merged.iloc[batch_size:]
+            buffer = [rest]
+            count = len(rest)
+    if count:
+        merged = _concat_pages(buffer, as_arrow)
+        yield merged if as_arrow else merged.reset_index(drop=True)
+
+
+def _concat_pages(pages: list, as_arrow: bool):
+    """Merges pages into one DataFrame or RecordBatch"""
+    if as_arrow:
+        if len(pages) == 1:
+            return pages[0]
+        return pa.Table.from_batches(pages).combine_chunks().to_batches()[0]
+    return pages[0] if len(pages) == 1 else pd.concat(pages, ignore_index=True)
+
+
+def estimate_bytes(query: str, params: dict = None) -> int:
+    """Estimates the bytes a query would process with a dry run (free)"""
+    job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False,
+                                         query_parameters=build_query_parameters(params))
+    return lazy_client().query(query, job_config=job_config).total_bytes_processed
+
+
+def iter_queries(queries: dict, max_concurrent: int = 4, timeout=None, dry_run: bool = False):
+    """Runs queries concurrently and yields the results as they finish
+
+    Args:
+        queries (dict): name -> SQL
+        max_concurrent (int): max number of queries running at once. keep it within the slot reservation
+        timeout (float or dict): seconds to wait for each query, or name -> seconds.
+            a query exceeding it is cancelled
+        dry_run (bool): if True, logs the bytes each query would process before submitting them
+    Yields:
+        tuple of name and DataFrame, or the exception raised by the query
+    """
+    if dry_run:
+        total = 0
+        for name, query in queries.items():
+            estimated = estimate_bytes(query)
+            total += estimated
+            logger.info(f"{name}: {estimated / 1024 ** 3:.2f} GB will be processed.")
+        logger.info(f"Total {total / 1024 ** 3:.2f} GB will be processed by {len(queries)} queries.")
+
+    def run(name: str, query: str) -> pd.DataFrame:
+        _timeout = timeout.get(name) if isinstance(timeout, dict) else timeout
+        query_job = submit_query(query)
+        try:
+            rows = query_job.result(timeout=_timeout)
+        except TimeoutError:
+            query_job.cancel()
+            raise TimeoutError(f"{name} did not finish in {_timeout} seconds and was cancelled.")
+        return rows.to_dataframe()
+
+    with ThreadPoolExecutor(max_workers=max_concurrent) as executor:
+        futures = {executor.submit(run, name, query): name for name, query in queries.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                df = future.result()
+            except Exception as e:
+                logger.error(f"{name} failed: {e}")
+                yield name, e
+            else:
+                logger.info(f"{name}: {len(df)} rows were retrieved.")
+                yield name, df
+
+
+def run_queries(queries: dict, max_concurrent: int = 4, timeout=None, dry_run: bool = False) -> dict:
+    """Runs queries concurrently and returns the results (see iter_queries)
+
+    Returns:
+        dict of name -> DataFrame, or the exception raised by the query, in the order of queries
+    """
+    results = dict(iter_queries(queries, max_concurrent=max_concurrent, timeout=timeout, dry_run=dry_run))
+    return {name: results[name] for name in queries}
+
+
+def build_query_parameters(params: dict = None) -> list:
+    """Converts a dict of name -> value into query parameters, inferring their types
+
+    Values that are already query parameters are kept. Lists, tuples and arrays become arrays.
+    NumPy values, such as df['id'].max(), are converted to Python values.
+    """
+    if not params:
+        return []
+    parameters = []
+    for name, value in params.items():
+        if isinstance(value, (bigquery.ScalarQueryParameter, bigquery.ArrayQueryParameter)):
+            parameters.append(value)
+        elif isinstance(value, (list, tuple, np.ndarray, pd.Series)):
+            values = [_to_python(v) for v in value]
+            type_ = _parameter_type(values[0]) if values else 'STRING'
+            parameters.append(bigquery.ArrayQueryParameter(name, type_, values))
+        else:
+            value = _to_python(value)
+            parameters.append(bigquery.ScalarQueryParameter(name, _parameter_type(value), value))
+    return parameters
+
+
+def _to_python(value):
+    """Converts a NumPy scalar, which is not a subclass of int, float or bool, into a Python value"""
+    if isinstance(value, np.datetime64):
+        # item() returns an int for nanoseconds
+        return pd.Timestamp(value).to_pydatetime()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _parameter_type(value) -> str:
+    # bool is a subclass of int, and datetime of date
+    if isinstance(value, bool):
+        return 'BOOL'
+    if isinstance(value, int):
+        return 'INT64'
+    if isinstance(value, float):
+        return 'FLOAT64'
+    if isinstance(value, Decimal):
+        return 'NUMERIC'
+    if isinstance(value, datetime):
+        return 'TIMESTAMP' if value.tzinfo else 'DATETIME'
+    if isinstance(value, date):
+        return 'DATE'
+    return 'STRING'
+
+
+def submit_query(query: str, params: dict = None, maximum_bytes_billed: int = None) -> bigquery.QueryJob:
+    """Starts a query job with named parameters within a byte budget
+
+    When a budget is set, a dry run checks the estimate first, and the job is also
+    capped by maximum_bytes_billed so that BigQuery fails it rather than bill more.
+
+    Raises:
+        errors.BytesBudgetExceeded: the query would process more bytes than the budget
+    """
+    bq_client = lazy_client()
+    budget = maximum_bytes_billed or MAXIMUM_BYTES_BILLED
+    job_config = bigquery.QueryJobConfig(query_parameters=build_query_parameters(params))
+    if budget:
+        estimated = estimate_bytes(query, params=params)
+        logger.debug(f"{estimated} bytes will be processed.")
+        if estimated > budget:
+            raise errors.BytesBudgetExceeded(estimated=estimated, budget=budget)
+        job_config.maximum_bytes_billed = budget
     # Make a API request
     logger.debug(f"Querying BQ: {query}")
-    query_job = bq_client.query(query)
+    return bq_client.query(query, job_config=job_config)
+
+
+def run_query(query: str, page_size: int = None, params: dict = None, maximum_bytes_billed: int = None):
+    """Runs a query and waits for the result
+
+    Args:
+        query (str): SQL. refer to params as @name
+        page_size (int): rows per page of the result
+        params (dict): named query parameters (name -> value), types are inferred
+        maximum_bytes_billed (int): bytes the query may process. defaults to MAXIMUM_BYTES_BILLED
+    Returns:
+        google.cloud.bigquery.table.RowIterator
+    """
+    query_job = submit_query(query, params=params, maximum_bytes_billed=maximum_bytes_billed)
+
+    return query_job.result(page_size=page_size)  # Waits for query to finish
+
+
+def build_date_range_query(query: str, param: str = 'date') -> str:
+    """Rewrites a query for a single day into a query for a range of dates
+
+    `expression = @date` becomes `expression BETWEEN @start_date AND @end_date`, so that one query
+    scans the partitions of the range instead of running the query once per day.
+    The expression is a column or a function call such as DATE(created_at). Other comparisons
+    (>=, <=, !=) are left as they are.
+
+    Raises:
+        ValueError: no condition to rewrite, or @date is referenced elsewhere in the query
+    """
+    # a column (optionally qualified or quoted) or a function call, then a plain =
+    pattern = re.compile(r'([\w.`]+(?:\([^()]*\))?)\s*(?<![<>!=])=\s*@' + param + r'\b')
+    if not pattern.search(query):
+        raise ValueError(f"The query has no condition like `column = @{param}`.")
+    rewritten = pattern.sub(rf'\1 BETWEEN @start_{param} AND @end_{param}', query)
+    if re.search(r'@' + param + r'\b', rewritten):
+        raise ValueError(f"@{param} is referenced outside of `column = @{param}` and cannot be rewritten.")
+    return rewritten
+
+
+def get_df_for_date_range(query: str, start_date: str, end_date: str, format_: str = None,
+                          params: dict = None, **kwargs) -> pd.DataFrame:
+    """Runs a query written for a single day (`= @date`) once for the whole range of dates
+
+    This replaces a loop over utils.get_date_range that runs the query per day.
+
+    Args:
+        query (str): SQL with a condition like `date = @date`
+        start_date (str): YYYY-MM-DD
+        end_date (str): YYYY-MM-DD
+        format_ (str): if given, dates are passed as strings in this format, such as '%Y%m%d'
+            for _TABLE_SUFFIX. DATE parameters otherwise
+        params (dict): other named parameters
+        kwargs: passed to get_df_from_query
+    """
+    start = datetime.strptime(start_date, '%Y-%m-%d').date()
+    end = datetime.strptime(end_date, '%Y-%m-%d').date()
+    params = dict(params or {})
+    params['start_date'] = start.strftime(format_) if format_ else start
+    params['end_date'] = end.strftime(format_) if format_ else end
+    return get_df_from_query(build_date_range_query(query), params=params, **kwargs)
+
+
+"""Loading"""
+
+
+def _to_micros(value) -> int:
+    """TIMESTAMP: microseconds since epoch. naive values are UTC"""
+    ts = pd.Timestamp(value)
+    return (ts.tz_localize('UTC') if ts.tzinfo is None else ts).value // 1000
+
+
+def _to_days(value) -> int:
+    """DATE: days since epoch. aware values are converted to UTC, as BigQuery does"""
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert('UTC').tz_localize(None)
+    return (ts.normalize() - pd.Timestamp('1970-01-01')).days
+
+
+# protobuf field type and converter for each BigQuery type, used by the Storage Write API
+_PROTO_TYPES = {
+    'STRING': ('TYPE_STRING', str),
+    'INTEGER': ('TYPE_INT64', int),
+    'INT64': ('TYPE_INT64', int),
+    'FLOAT': ('TYPE_DOUBLE', float),
+    'FLOAT64': ('TYPE_DOUBLE', float),
+    'BOOLEAN': ('TYPE_BOOL', bool),
+    'BOOL': ('TYPE_BOOL', bool),
+    'NUMERIC': ('TYPE_STRING', str),
+    'BIGNUMERIC': ('TYPE_STRING', str),
+    'JSON': ('TYPE_STRING', lambda v: v if isinstance(v, str) else json.dumps(v, default=str)),
+    'TIMESTAMP': ('TYPE_INT64', _to_micros),
+    'DATE': ('TYPE_INT32', _to_days),
+    'DATETIME': ('TYPE_STRING', lambda v: pd.Timestamp(v).strftime('%Y-%m-%d %H:%M:%S.%f')),
+}
+# AppendRows requests must be under 10MB
+_APPEND_ROWS_BYTES = 1024 * 1024 * 8
+
+
+def load_df(data,
+            table_id: str,
+            mode: str = 'append',
+            key=None,
+            partition: str = None,
+            streaming: bool = False,
+            max_pending: int = 2) -> int:
+    """Loads a DataFrame or an iterator of DataFrames into a table
+
+    Bulk data goes through load jobs from Parquet. Frames are uploaded by a background thread
+    while the iterator fetches the next ones; max_pending bounds the frames waiting in memory.
+    With streaming=True, rows are appended through the default stream of the Storage Write API.
+
+    Args:
+        data: a DataFrame, or an iterator of DataFrames such as Pardot pages
+        table_id (str): project.dataset.table
+        mode (str): 'append', 'truncate' (replaces the table or the partition) or 'merge'
+        key (str or list): key columns to upsert by when mode='merge'
+        partition (str): partition to load into, such as 20240101 (table_id$20240101)
+        streaming (bool): if True, use the Storage Write API (mode='append' only)
+        max_pending (int): frames waiting to be uploaded before the iterator is paused
+    Returns:
+        number of rows loaded
+    """
+    if mode not in ('append', 'truncate', 'merge'):
+        raise ValueError("mode must be 'append', 'truncate' or 'merge'")
+    if streaming and (mode != 'append' or partition):
+        raise ValueError("streaming supports only mode='append' without a partition")
+    if mode == 'merge' and (not key or partition):
+        raise ValueError("mode='merge' requires key and does not support a partition")
+    frames = [data] if isinstance(data, pd.DataFrame) else data
+
+    if streaming:
+        return _append_rows(frames, table_id)
+    if mode == 'merge':
+        return _merge(frames, table_id, [key] if isinstance(key, str) else list(key), max_pending)
+
+    destination = f"{table_id}${partition}" if partition else table_id
+    return _load_frames(frames, destination, truncate=mode == 'truncate', max_pending=max_pending)
+
+
+def _load_frames(frames, destination: str, truncate: bool = False, max_pending: int = 2, schema: list = None) -> int:
+    """Runs a load job per frame, one at a time in a background thread, in the order of frames"""
+    bq_client = lazy_client()
+
+    def load(df: pd.DataFrame, disposition: str) -> int:
+        job_config = bigquery.LoadJobConfig(source_format=bigquery.SourceFormat.PARQUET,
+                                            write_disposition=disposition,
+                                            schema=[f for f in schema if f.name in df.columns] if schema else None)
+        bq_client.load_table_from_dataframe(df, destination, job_config=job_config).result()
+        logger.debug(f"{len(df)} rows were loaded to {destination}.")
+        return len(df)
+
+    total = 0
+    pending = []
+    disposition = 'WRITE_TRUNCATE' if truncate else 'WRITE_APPEND'
+    # one worker keeps the jobs in order, so that the first one can truncate
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        for df in frames:
+            if not len(df):
+                continue
+            pending.append(executor.submit(load, df, disposition))
+            disposition = 'WRITE_APPEND'
+            while len(pending) > max_pending:
+                total += pending.pop(0).result()
+        for future in pending:
+            total += future.result()
+    logger.info(f"{total} rows were loaded to {destination}.")
+    return total
+
+
+def _merge(frames, table_id: str, keys: list, max_pending: int) -> int:
+    """Loads frames into a staging table, then upserts them into the table by the keys
+
+    Rows with the same keys, such as from overlapping pages, are merged only once.
+    Which of them is kept is not defined.
+    """
+    bq_client = lazy_client()
+    staging_id = f"{table_id}__staging_{uuid.uuid4().hex[:8]}"
+    # the staging table takes the schema of the table so that MERGE compares the same types
+    schema = bq_client.get_table(table_id).schema
+    try:
+        total = _load_frames(frames, staging_id, truncate=True, max_pending=max_pending, schema=schema)
+        if not total:
+            return 0
+        columns = [field.name for field in bq_client.get_table(staging_id).schema]
+        on = ' AND '.join(f"T.`{k}` = S.`{k}`" for k in keys)
+        updates = ', '.join(f"`{c}` = S.`{c}`" for c in columns if c not in keys)
+        names = ', '.join(f"`{c}`" for c in columns)
+        partition = ', '.join(f"`{k}`" for k in keys)
+        # MERGE fails if a row of the table matches more than one source row
+        source = (f"(SELECT * FROM `{staging_id}` WHERE TRUE "
+                  f"QUALIFY ROW_NUMBER() OVER (PARTITION BY {partition}) = 1)")
+        query = (f"MERGE `{table_id}` T USING {source} S ON {on} "
+                 + (f"WHEN MATCHED THEN UPDATE SET {updates} " if updates else "")
+                 + f"WHEN NOT MATCHED THEN INSERT ({names}) VALUES ({names})")
+        run_query(query)
+        logger.info(f"{total} rows were merged into {table_id}.")
+        return total
+    finally:
+        bq_client.delete_table(staging_id, not_found_ok=True)
+
+
+def _proto_class(schema: list):
+    """Builds a protobuf message class for rows of a table schema"""
+    from google.protobuf import descriptor_pb2, descriptor_pool
+    try:
+        from google.protobuf.message_factory import GetMessageClass
+    except ImportError:
+        # protobuf < 4.21
+        from google.protobuf.message_factory import MessageFactory
+        GetMessageClass = MessageFactory().GetPrototype
+
+    file_proto = descriptor_pb2.FileDescriptorProto(name=f"row_{uuid.uuid4().hex}.proto", package='megaton',
+                                                    syntax='proto2')
+    message_proto = file_proto.message_type.add(name='Row')
+    for number, field in enumerate(schema, 1):
+        if field.field_type not in _PROTO_TYPES:
+            raise ValueError(f"Column {field.name} of type {field.field_type} is not supported by streaming.")
+        message_proto.field.add(
+            name=field.name,
+            number=number,
+            type=getattr(descriptor_pb2.FieldDescriptorProto, _PROTO_TYPES[field.field_type][0]),
+            label=descriptor_pb2.FieldDescriptorProto.LABEL_REPEATED if field.mode == 'REPEATED'
+            else descriptor_pb2.FieldDescriptorProto.LABEL_OPTIONAL,
+        )
+    pool = descriptor_pool.DescriptorPool()
+    pool.AddSerializedFile(file_proto.SerializeToString())
+    return GetMessageClass(pool.FindMessageTypeByName('megaton.Row')), message_proto
+
+
+def _serialize_rows(df: pd.DataFrame, schema: list, message_class) -> list:
+    """Serializes the rows of a DataFrame into protobuf messages. missing columns and nulls are left unset
+
+    Raises:
+        ValueError: the DataFrame has columns the table does not, which a load job would reject too
+    """
+    unknown = [c for c in df.columns if c not in {f.name for f in schema}]
+    if unknown:
+        raise ValueError(f"Columns not in the table schema: {unknown}")
+    fields = [(f.name, f.mode == 'REPEATED', _PROTO_TYPES[f.field_type][1]) for f in schema if f.name in df.columns]
+    rows = []
+    for record in df[[name for name, _, _ in fields]].itertuples(index=False, name=None):
+        message = message_class()
+        for (name, repeated, convert), value in zip(fields, record):
+            # pd.isna is elementwise for arrays
+            is_array = isinstance(value, (list, tuple, dict, np.ndarray))
+            if repeated:
+                if is_array and len(value):
+                    getattr(message, name).extend(convert(v) for v in value)
+            elif is_array or not pd.isna(value):
+                setattr(message, name, convert(value))
+        rows.append(message.SerializeToString())
+    return rows
+
+
+def _append_rows(frames, table_id: str) -> int:
+    """Appends rows to the default stream of the Storage Write API"""
+    from google.cloud import bigquery_storage_v1
+    from google.cloud.bigquery_storage_v1 import types, writer
+
+    bq_client = lazy_client()
+    table = bq_client.get_table(table_id)
+    message_class, message_proto = _proto_class(table.schema)
+
+    write_client = bigquery_storage_v1.BigQueryWriteClient()
+    parent = write_client.table_path(table.project, table.dataset_id, table.table_id)
+    template = types.AppendRowsRequest(write_stream=f"{parent}/streams/_default")
+    template.proto_rows = types.AppendRowsRequest.ProtoData(
+        writer_schema=types.ProtoSchema(proto_descriptor=message_proto))
+    stream = writer.AppendRowsStream(write_client, template)
+
+    def send(serialized: list):
+        request = types.AppendRowsRequest()
+        request.proto_rows = types.AppendRowsRequest.ProtoData(rows=types.ProtoRows(serialized_rows=serialized))
+        return stream.send(request)
 
-    return query_job.result()  # Waits for query to finish
+    total = 0
+    futures = []
+    try:
+        for df in frames:
+            batch, size = [], 0
+            for row in _serialize_rows(df, table.schema, message_class):
+                if batch and size + len(row) > _APPEND_ROWS_BYTES:
+                    futures.append(send(batch))
+                    batch, size = [], 0
+                batch.append(row)
+                size += len(row)
+            if batch:
+                futures.append(send(batch))
+            total += len(df)
+        # appends are acknowledged in order; wait for all of them
+        for future in futures:
+            future.result()
+    finally:
+        stream.close()
+    logger.info(f"{total} rows were appended to {table_id}.")
+    return total
@@ -60,6 +60,24 @@ class UrlNotFound(Error):
         self.message = message or "The URL requested is not found."
 
 
+class BytesBudgetExceeded(Error):
+    """The query would process more bytes than allowed"""
+
+    def __init__(self, message=None, estimated=None, budget=None):
+        self.message = message or f"The query would process {estimated} bytes, over the budget of {budget} bytes."
+        self.estimated = estimated
+        self.budget = budget
+        super().__init__(self.message)
+
+
+class ChecksumMismatch(Error):
+    """Checksum of the data downloaded does not match the one of the object"""
+
+    def __init__(self, message=None):
+        self.message = message or "The checksum of the downloaded data does not match."
+        super().__init__(self.message)
+
+
 class NoDataReturned(Error):
     """No data was returned from API."""
     pass
@@ -1,11 +1,22 @@
 """Common helper GCS functions"""
+from __future__ import annotations
 
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import hashlib
+import io
+import mimetypes
+import mmap
 import os
+import uuid
 from logging import basicConfig, DEBUG, INFO, WARNING
 
 from google.cloud import storage
+import google_crc32c
+import pandas as pd
 
-from . import log
+from . import errors, log
 
 PROJECT_ID = os.getenv("GCP_PROJECT")
 logger = log.Logger(__name__)
@@ -15,6 +26,23 @@ logger.setLevel(INFO)
 # https://cloud.google.com/functions/docs/bestpractices/tips#use_global_variables_to_reuse_objects_in_future_invocations
 CS_CLIENT = None
 
+# GCS accepts up to 100 calls in a batch request
+BATCH_SIZE = 100
+# resumable upload chunks must be a multiple of 256KB
+CHUNK_UNIT = 256 * 1024
+
+# chunk size of resumable uploads scales with the file size within this range
+MIN_CHUNK_SIZE = 1024 * 1024 * 5  # 5MB
+MAX_CHUNK_SIZE = 1024 * 1024 * 100  # 100MB
+# GCS composes up to 32 objects in a request
+MAX_COMPOSE = 32
+
+CONTENT_TYPES = {
+    'tsv': 'text/tab-separated-values',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
 
 def lazy_client() -> storage.Client:
     """Returns a Storage Client that may be shared between cloud function invocations.
@@ -26,18 +54,37 @@ def lazy_client() -> storage.Client:
     return CS_CLIENT
 
 
-def upload_object(bucket_name: str, local_path: str, remote_path: str = None) -> str:
+def get_chunk_size(file_size: int) -> int:
+    """Chunk size for a resumable upload: about 100 chunks per file, from 5MB to 100MB"""
+    size = min(MAX_CHUNK_SIZE, max(MIN_CHUNK_SIZE, file_size // 100))
+    return size // CHUNK_UNIT * CHUNK_UNIT
+
+
+def upload_object(bucket_name: str,
+                  local_path: str,
+                  remote_path: str = None,
+                  composite_threshold: int = None,
+                  workers: int = 8) -> str:
     """GCSにファイルを転送する
+
+    Args:
+        composite_threshold (int): files of this size (bytes) or larger are uploaded
+            in parallel parts with upload_large_object. disabled if None
+        workers (int): number of parts uploaded concurrently for large files
     """
     if not remote_path:
         remote_path = os.path.basename(local_path)
+    file_size = os.path.getsize(local_path)
+    if composite_threshold and file_size >= composite_threshold:
+        return upload_large_object(bucket_name, local_path, remote_path, workers=workers)
+
     client = lazy_client()
     bucket = client.bucket(bucket_name)
     blob = bucket.blob(remote_path)
 
     # https://github.com/googleapis/python-storage/issues/74
     blob._MAX_MULTIPART_SIZE = 1024 * 1024 * 5  # 5MB
-    blob.chunk_size = 1024 * 1024 * 5  # 5MB
+    blob.chunk_size = get_chunk_size(file_size)
 
     try:
         logger.debug(f"Uploading {local_path} to gs://{bucket_name}/{remote_path}")
@@ -49,6 +96,353 @@ def upload_object(bucket_name: str, local_path: str, remote_path: str = None) ->
         return blob.public_url
 
 
+class _FileSlice(io.RawIOBase):
+    """Reads bytes [offset, offset + length) of a file as a stream of its own, starting at 0.
+    Resumable uploads require the stream to be at its beginning and track it with tell()
+    """
+
+    def __init__(self, path: str, offset: int, length: int):
+        self._file = open(path, 'rb')
+        self.offset = offset
+        self.length = length
+        self._pos = 0
+        self._file.seek(offset)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos: int, whence: int = io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self.length
+        self._pos = max(0, min(pos, self.length))
+        self._file.seek(self.offset + self._pos)
+        return self._pos
+
+    def readinto(self, b):
+        size = min(len(b), self.length - self._pos)
+        if size <= 0:
+            return 0
+        read = self._file.readinto(memoryview(b)[:size])
+        self._pos += read
+        return read
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def upload_large_object(bucket_name: str,
+                        local_path: str,
+                        remote_path: str = None,
+                        parts: int = MAX_COMPOSE,
+                        workers: int = 8) -> str:
+    """大きなファイルを分割して並列でGCSに転送し、composeで結合する
+
+    The file is split into up to 32 parts uploaded concurrently as temporary objects,
+    which are composed into the final object and then deleted.
+    Composite objects have a CRC32C checksum but no MD5 hash.
+
+    Returns:
+        public url of the object
+    """
+    if not remote_path:
+        remote_path = os.path.basename(local_path)
+    file_size = os.path.getsize(local_path)
+    parts = max(1, min(parts, MAX_COMPOSE))
+    part_size = -(-file_size // parts)  # ceil
+    part_size = max(CHUNK_UNIT, -(-part_size // CHUNK_UNIT) * CHUNK_UNIT)
+    offsets = list(range(0, file_size, part_size)) or [0]
+
+    bucket = lazy_client().bucket(bucket_name)
+    prefix = f"{remote_path}.part-{uuid.uuid4().hex}"
+    part_blobs = [bucket.blob(f"{prefix}-{i:02d}") for i in range(len(offsets))]
+
+    def upload_part(i: int):
+        length = min(part_size, file_size - offsets[i])
+        blob = part_blobs[i]
+        blob._MAX_MULTIPART_SIZE = MIN_CHUNK_SIZE
+        blob.chunk_size = get_chunk_size(length)
+        with _FileSlice(local_path, offsets[i], length) as f:
+            blob.upload_from_file(f, size=length, timeout=3600)
+
+    logger.debug(f"Uploading {local_path} to gs://{bucket_name}/{remote_path} in {len(offsets)} parts")
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(upload_part, range(len(offsets))))
+        blob = bucket.blob(remote_path)
+        blob.content_type = mimetypes.guess_type(local_path)[0] or 'application/octet-stream'
+        blob.compose(part_blobs, timeout=3600)
+    finally:
+        # parts that failed to upload do not exist
+        bucket.delete_blobs(part_blobs, on_error=lambda b: None)
+    return blob.public_url
+
+
+def _cancel_upload(writer):
+    """Cancels the resumable upload of a BlobWriter without finalizing the object"""
+    if hasattr(writer, 'terminate'):
+        # newer google-cloud-storage
+        writer.terminate()
+        return
+    upload_and_transport = getattr(writer, '_upload_and_transport', None)
+    if upload_and_transport:
+        upload, transport = upload_and_transport
+        transport.delete(upload.upload_url)
+    # nothing is sent on close once the buffer is closed
+    writer._buffer.close()
+
+
+def upload_dataframe(bucket_name: str,
+                     remote_path: str,
+                     data,
+                     format_: str = 'tsv',
+                     compress: bool = False,
+                     header: bool = False,
+                     part_size: int = 1024 * 1024 * 8,
+                     schema=None) -> str:
+    """DataFrameをローカルに保存せずにGCSへストリーミングで転送する
+
+    Each frame is encoded and written into a resumable upload as it comes,
+    so only the current frame and one part are held in memory.
+
+    Args:
+        bucket_name (str): bucket to upload to
+        remote_path (str): name of the object
+        data: a DataFrame, or an iterator of DataFrames such as Pardot pages
+        format_ (str): tsv, csv or parquet
+        compress (bool): if True, the object is gzip-compressed
+        header (bool): if True, tsv/csv starts with a header row (as files.save_df_to_file does not)
+        part_size (int): bytes sent per request of the resumable upload. rounded to 256KB
+        schema (pyarrow.Schema): schema of the parquet file. taken from the first frame if None,
+            with columns that are all None there typed as string
+    Returns:
+        public url of the object
+    """
+    if format_ not in CONTENT_TYPES:
+        raise ValueError(f"format_ must be one of {list(CONTENT_TYPES)}")
+    frames = [data] if isinstance(data, pd.DataFrame) else data
+    part_size = max(CHUNK_UNIT, part_size // CHUNK_UNIT * CHUNK_UNIT)
+    blob = lazy_client().bucket(bucket_name).blob(remote_path)
+    content_type = 'application/gzip' if compress else CONTENT_TYPES[format_]
+
+    logger.debug(f"Streaming dataframes to gs://{bucket_name}/{remote_path}")
+    rows = 0
+    writer = blob.open('wb', chunk_size=part_size, content_type=content_type, ignore_flush=True)
+    stream = gzip.GzipFile(fileobj=writer, mode='wb') if compress else writer
+    parquet_writer = None
+    try:
+        for i, df in enumerate(frames):
+            if format_ == 'parquet':
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                if parquet_writer is None:
+                    if schema is None:
+                        # later frames cannot be cast to null
+                        schema = pa.schema([pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f
+                                            for f in table.schema])
+                    parquet_writer = pq.ParquetWriter(stream, schema)
+                parquet_writer.write_table(table.cast(parquet_writer.schema))
+            else:
+                text = df.to_csv(header=header and i == 0,
+                                 index=False,
+                                 sep='\t' if format_ == 'tsv' else ',')
+                stream.write(text.encode('utf-8'))
+            rows += len(df)
+    except BaseException:
+        # closing would write the footer and finalize a truncated but valid object
+        logger.warning(f"Cancelling the upload to gs://{bucket_name}/{remote_path}")
+        _cancel_upload(writer)
+        raise
+    if parquet_writer is not None:
+        parquet_writer.close()
+    if compress:
+        stream.close()
+    writer.close()
+    logger.info(f"{rows} rows were saved to gs://{bucket_name}/{remote_path}.")
+    return blob.public_url
+
+
+class _Checksum(object):
+    """Computes the checksum GCS keeps for an object: CRC32C, or MD5 if the object has no CRC32C"""
+
+    def __init__(self, blob: storage.Blob):
+        self.blob = blob
+        self.expected = blob.crc32c or blob.md5_hash
+        self._hash = google_crc32c.Checksum() if blob.crc32c else hashlib.md5()
+
+    def update(self, data):
+        self._hash.update(data)
+
+    def verify(self):
+        if not self.expected:
+            logger.warning(f"{self.blob.name} has no checksum to verify.")
+            return
+        actual = base64.b64encode(self._hash.digest()).decode('utf-8')
+        if actual != self.expected:
+            raise errors.ChecksumMismatch(
+                f"Checksum of gs://{self.blob.bucket.name}/{self.blob.name} does not match: "
+                f"{actual} != {self.expected}")
+
+
+class _ChecksumReader(io.RawIOBase):
+    """Wraps a blob reader to compute the checksum of the bytes read"""
+
+    def __init__(self, reader, checksum: _Checksum):
+        self.reader = reader
+        self.checksum = checksum
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.reader.read(len(b))
+        self.checksum.update(data)
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.reader.close()
+        super().close()
+
+    def verify(self):
+        """Reads the rest of the object, then verifies the checksum"""
+        while self.read(CHUNK_UNIT * 4):
+            pass
+        self.checksum.verify()
+
+
+def _get_blob(bucket_name: str, remote_path: str) -> storage.Blob:
+    blob = lazy_client().bucket(bucket_name).get_blob(remote_path)
+    if blob is None:
+        raise FileNotFoundError(f"gs://{bucket_name}/{remote_path} is not found.")
+    return blob
+
+
+def download_object(bucket_name: str,
+                    remote_path: str,
+                    local_path: str = None,
+                    part_size: int = 1024 * 1024 * 32,
+                    workers: int = 8,
+                    verify: bool = True):
+    """GCSのファイルを範囲ごとに並列でダウンロードする
+
+    Byte ranges are fetched concurrently and written into a preallocated file through a
+    memory map, or into a bytearray if local_path is not given. Data is stored as is
+    (no decompressive transcoding), then its CRC32C/MD5 checksum is verified.
+
+    Returns:
+        local_path, or a bytearray of the content
+    Raises:
+        errors.ChecksumMismatch: the downloaded data is corrupted
+    """
+    blob = _get_blob(bucket_name, remote_path)
+    size = blob.size or 0
+    starts = list(range(0, size, part_size))
+    logger.debug(f"Downloading gs://{bucket_name}/{remote_path} ({size} bytes) in {len(starts)} parts")
+
+    if local_path:
+        f = open(local_path, 'wb+')
+        f.truncate(size)
+        buffer = mmap.mmap(f.fileno(), size) if size else bytearray()
+    else:
+        f = None
+        buffer = bytearray(size)
+
+    def fetch(start: int):
+        end = min(start + part_size, size) - 1
+        data = blob.download_as_bytes(start=start, end=end, raw_download=True, checksum=None)
+        buffer[start:start + len(data)] = data
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(fetch, starts))
+        if verify:
+            checksum = _Checksum(blob)
+            for start in starts:
+                checksum.update(bytes(buffer[start:start + part_size]))
+            checksum.verify()
+    finally:
+        if f:
+            if size:
+                buffer.close()
+            f.close()
+    return local_path if local_path else buffer
+
+
+def open_object(bucket_name: str, remote_path: str, decompress: bool = None, chunk_size: int = 1024 * 1024 * 8):
+    """Opens an object as a binary stream read part by part
+
+    Returns:
+        tuple of the binary stream and a function to verify the checksum after reading
+    """
+    blob = _get_blob(bucket_name, remote_path)
+    reader = _ChecksumReader(blob.open('rb', chunk_size=chunk_size, raw_download=True), _Checksum(blob))
+    if decompress is None:
+        decompress = remote_path.endswith('.gz') or blob.content_encoding == 'gzip'
+    stream = io.BufferedReader(reader, buffer_size=CHUNK_UNIT)
+    if decompress:
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    return stream, reader.verify
+
+
+def iter_lines(bucket_name: str, remote_path: str, encoding: str = 'utf-8', decompress: bool = None,
+               verify: bool = True):
+    """GCSのテキストファイルを一行ずつ読み込む (gzipは自動で解凍)
+
+    Lines are yielded without the line break. The checksum is verified after the last line.
+    """
+    stream, verify_checksum = open_object(bucket_name, remote_path, decompress=decompress)
+    with io.TextIOWrapper(stream, encoding=encoding) as text:
+        for line in text:
+            yield line.rstrip('\r\n')
+        if verify:
+            verify_checksum()
+
+
+def iter_df(bucket_name: str, remote_path: str, chunksize: int = 100000, sep: str = '\t', header=None,
+            decompress: bool = None, verify: bool = True, **kwargs):
+    """GCSのTSV/CSVファイルをDataFrameのチャンクごとに読み込む (gzipは自動で解凍)
+
+    Args:
+        chunksize (int): rows per DataFrame
+        sep (str): delimiter. defaults to tab
+        header: row number of the header, None for files saved by files.save_df_to_file
+        kwargs: passed to pd.read_csv
+    """
+    stream, verify_checksum = open_object(bucket_name, remote_path, decompress=decompress)
+    with stream:
+        for df in pd.read_csv(stream, sep=sep, header=header, chunksize=chunksize, **kwargs):
+            yield df
+        if verify:
+            verify_checksum()
+
+
+def read_text(bucket_name: str, blob_name: str) -> str | None:
+    """GCSのテキストファイルを読み込む。存在しなければNoneを返す
+    """
+    blob = lazy_client().bucket(bucket_name).blob(blob_name)
+    if not blob.exists():
+        return None
+    return blob.download_as_bytes().decode('utf-8')
+
+
+def write_text(bucket_name: str, blob_name: str, text: str, content_type: str = 'text/plain') -> None:
+    """GCSにテキストを書き込む
+    """
+    blob = lazy_client().bucket(bucket_name).blob(blob_name)
+    logger.debug(f"Writing gs://{bucket_name}/{blob_name}")
+    blob.upload_from_string(text, content_type=content_type)
+
+
 def delete_object(bucket_name: str, blob_name: str) -> None:
     """GCSからファイルを削除する
     """
@@ -70,3 +464,103 @@ def copy_file(source_bucket_name: str, destination_bucket_name: str, source_blob
     blob_copy = source_bucket.copy_blob(
         source_blob, destination_bucket, source_blob_name
     )
+
+
+def _result(name: str, error: Exception = None) -> dict:
+    """A line of the report returned by bulk functions"""
+    if error:
+        logger.warning(f"{name}: {error}")
+    return {'name': name, 'ok': error is None, 'error': error}
+
+
+def upload_objects(bucket_name: str, files: list, workers: int = 8) -> list:
+    """複数のファイルを並列でGCSに転送する
+
+    Args:
+        bucket_name (str): bucket to upload to
+        files (list): local paths, or tuples of (local path, remote path)
+        workers (int): number of files to upload concurrently
+    Returns:
+        list of dict {'name': remote path, 'ok': bool, 'error': Exception or None}
+    """
+    pairs = [f if isinstance(f, (tuple, list)) else (f, os.path.basename(f)) for f in files]
+    lazy_client()  # create the shared client before the threads use it
+
+    def upload(pair: tuple) -> dict:
+        local_path, remote_path = pair
+        try:
+            upload_object(bucket_name, local_path, remote_path)
+        except Exception as e:
+            return _result(remote_path, e)
+        return _result(remote_path)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(upload, pairs))
+    logger.info(f"Uploaded {sum(r['ok'] for r in results)}/{len(results)} files to gs://{bucket_name}.")
+    return results
+
+
+def copy_files(source_bucket_name: str, destination_bucket_name: str, blob_names: list, workers: int = 8) -> list:
+    """GCSの複数ファイルを並列で別のBucketへコピーする
+
+    Copies are sent one per call: a copy between locations or storage classes may need
+    several rewrite calls, which cannot be part of a batch request.
+
+    Returns:
+        list of dict {'name': blob name, 'ok': bool, 'error': Exception or None}
+    """
+    client = lazy_client()
+    source_bucket = client.bucket(source_bucket_name)
+    destination_bucket = client.bucket(destination_bucket_name)
+
+    def copy(name: str) -> dict:
+        try:
+            source_bucket.copy_blob(source_bucket.blob(name), destination_bucket, name)
+        except Exception as e:
+            return _result(name, e)
+        return _result(name)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(copy, blob_names))
+    logger.info(f"Copied {sum(r['ok'] for r in results)}/{len(results)} files "
+                f"from gs://{source_bucket_name} to gs://{destination_bucket_name}.")
+    return results
+
+
+def delete_objects(bucket_name: str, blob_names: list, workers: int = 4) -> list:
+    """GCSから複数のファイルを削除する
+
+    Deletes are sent in batch requests of BATCH_SIZE calls, several batches at a time.
+    When a batch fails, its objects are checked one by one to report which were not deleted.
+
+    Returns:
+        list of dict {'name': blob name, 'ok': bool, 'error': Exception or None}
+    """
+    client = lazy_client()
+    bucket = client.bucket(bucket_name)
+
+    def delete_batch(names: list) -> list:
+        try:
+            # the batch stack of the client is thread-local
+            with client.batch():
+                for name in names:
+                    bucket.delete_blob(name)
+        except Exception as e:
+            logger.debug(f"A batch failed ({e}). Checking each object.")
+            results = []
+            for name in names:
+                try:
+                    if bucket.blob(name).exists():
+                        bucket.delete_blob(name)
+                except Exception as e:
+                    results.append(_result(name, e))
+                else:
+                    results.append(_result(name))
+            return results
+        return [_result(name) for name in names]
+
+    batches = [blob_names[i:i + BATCH_SIZE] for i in range(0, len(blob_names), BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = [r for batch in executor.map(delete_batch, batches) for r in batch]
+    logger.info(f"Deleted {sum(r['ok'] for r in results)}/{len(results)} files from gs://{bucket_name}.")
+    return results
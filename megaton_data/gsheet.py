@@ -3,7 +3,18 @@ Functions for Google Sheets
 """
 
 from typing import Optional, Union
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import json
 import logging
+import random
+import re
+import threading
+import time
+import uuid
+
+import numpy as np
 import pandas as pd
 
 from google.oauth2.credentials import Credentials
@@ -16,6 +27,172 @@ from . import errors
 
 LOGGER = logging.getLogger(__name__)
 
+# Sheets API recommends keeping a request under 2MB
+MAX_CELLS_PER_REQUEST = 50000
+MAX_BYTES_PER_REQUEST = 2 * 1024 * 1024
+
+
+# write requests per minute per user
+WRITE_REQUESTS_PER_MINUTE = 60
+
+
+class RateLimiter(object):
+    """Blocks until a request fits in the number of requests allowed per minute"""
+
+    def __init__(self, max_per_minute: int = WRITE_REQUESTS_PER_MINUTE):
+        self.max_per_minute = max_per_minute
+        self._sent = deque()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._sent and now - self._sent[0] >= 60:
+                    self._sent.popleft()
+                if len(self._sent) < self.max_per_minute:
+                    self._sent.append(now)
+                    return
+                delay = 60 - (now - self._sent[0])
+                LOGGER.debug(f"write quota reached. waiting {delay:.1f} seconds.")
+                time.sleep(delay)
+
+
+WRITE_LIMITER = RateLimiter()
+
+
+def _call(func, *args, limiter: RateLimiter = WRITE_LIMITER, max_retries: int = 5, backoff: float = 1.0):
+    """Calls the API within the quota, retrying 429 with jittered exponential backoff"""
+    attempt = 0
+    while True:
+        if limiter:
+            limiter.wait()
+        try:
+            return func(*args)
+        except gspread.exceptions.APIError as e:
+            status = getattr(getattr(e, 'response', None), 'status_code', None)
+            if status != 429 or attempt >= max_retries:
+                raise
+            delay = random.uniform(0, backoff * 2 ** attempt)
+            LOGGER.warning(f"HTTP 429: retrying in {delay:.1f} seconds.")
+            time.sleep(delay)
+            attempt += 1
+
+
+def _auto_resize_requests(sheet_id: int, cols: list) -> list:
+    """Builds requests to auto resize columns to fit text"""
+    return [
+        {
+            "autoResizeDimensions": {
+                "dimensions": {
+                    "sheetId": sheet_id,
+                    "dimension": "COLUMNS",
+                    "startIndex": i - 1,
+                    "endIndex": i
+                }
+            }
+        }
+        for i in cols
+    ]
+
+
+def _resize_requests(sheet_id: int, cols: list, width: int) -> list:
+    """Builds requests to resize columns"""
+    return [
+        {
+            "updateDimensionProperties": {
+                "range": {
+                    "sheetId": sheet_id,
+                    "dimension": "COLUMNS",
+                    "startIndex": i - 1,
+                    "endIndex": i
+                },
+                "properties": {
+                    "pixelSize": width
+                },
+                "fields": "pixelSize"
+            }
+        }
+        for i in cols
+    ]
+
+
+def _grid_request(sheet_id: int, rows: Optional[int] = None, cols: Optional[int] = None,
+                  frozen_rows: Optional[int] = None, frozen_cols: Optional[int] = None) -> dict:
+    """Builds a request to set the size and frozen rows and/or columns of the sheet"""
+    grid, fields = {}, []
+    for key, value in (('rowCount', rows), ('columnCount', cols),
+                       ('frozenRowCount', frozen_rows), ('frozenColumnCount', frozen_cols)):
+        if value is not None:
+            grid[key] = value
+            fields.append(key)
+    return {
+        "updateSheetProperties": {
+            "properties": {
+                "sheetId": sheet_id,
+                "gridProperties": grid
+            },
+            "fields": f"gridProperties({','.join(fields)})"
+        }
+    }
+
+
+def _cell_value(value):
+    """Converts a value of a DataFrame into one JSON can send"""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, (datetime.date, datetime.time)):
+        return str(value)
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def _df_to_values(df: pd.DataFrame, include_index: bool = False, include_column_header: bool = False) -> list:
+    """Converts a DataFrame into rows of cell values. Missing values become empty cells."""
+    if include_index:
+        df = df.reset_index()
+    values = [[str(c) for c in df.columns]] if include_column_header else []
+    df = df.astype(object).where(df.notna(), '')
+    for row in df.itertuples(index=False, name=None):
+        values.append([_cell_value(v) for v in row])
+    return values
+
+
+def _columns_to_df(columns: list, date_columns: Optional[list] = None) -> pd.DataFrame:
+    """Builds a DataFrame from columns of cell values whose first value is the header
+
+    Columns are padded to the same length, as the API trims empty cells at the end of each.
+    Dates rendered as serial numbers are converted with the epoch of Sheets (1899-12-30).
+    """
+    length = max((len(c) - 1 for c in columns if c), default=0)
+    data = {}
+    for column in columns:
+        if not column:
+            continue
+        values = [None if v == '' else v for v in column[1:]]
+        values += [None] * (length - len(values))
+        series = pd.Series(values, dtype=object).infer_objects()
+        if date_columns and column[0] in date_columns:
+            series = pd.to_datetime(pd.to_numeric(series, errors='coerce'), unit='D', origin='1899-12-30')
+        data[str(column[0])] = series
+    return pd.DataFrame(data, index=pd.RangeIndex(length))
+
+
+def _iter_chunks(values: list, max_cells: int = MAX_CELLS_PER_REQUEST, max_bytes: int = MAX_BYTES_PER_REQUEST):
+    """Splits rows into chunks under the cell and byte budgets, keeping their order"""
+    chunk, cells, size = [], 0, 0
+    for row in values:
+        row_size = len(json.dumps(row))
+        if chunk and (cells + len(row) > max_cells or size + row_size > max_bytes):
+            yield chunk
+            chunk, cells, size = [], 0, 0
+        chunk.append(row)
+        cells += len(row)
+        size += row_size
+    if chunk:
+        yield chunk
+
 
 class MegatonGS(object):
     """Google Sheets client
@@ -94,12 +271,162 @@ class MegatonGS(object):
 
         return title
 
+    def batch(self, max_workers: int = 4):
+        """Start a batch session to write many sheets with a few requests per spreadsheet
+
+            with gs.batch() as batch:
+                batch.write(df, 'Summary')
+                batch.auto_resize([1, 2], 'Summary')
+                batch.write(df2, 'Detail', url=other_url)
+        """
+        return self.Batch(self, max_workers=max_workers)
+
+    class Batch(object):
+        """Collects value writes and formatting requests for sheets of one or more spreadsheets
+
+        On flush, each spreadsheet gets up to three requests: a batchUpdate that clears sheets and
+        grows grids too small for the values, one values.batchUpdate, then a batchUpdate that fits
+        the grids to the values and formats. Spreadsheets are flushed concurrently.
+        Sheets are given by name, in the spreadsheet open in the client or the one at url.
+        """
+
+        def __init__(self, parent, max_workers: int = 4):
+            self.parent = parent
+            self.max_workers = max_workers
+            self._spreadsheets = {}
+            self._worksheets = {}
+            self._pending = {}
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            if exc_type is None:
+                self.flush()
+
+        def _open(self, url: Optional[str] = None) -> gspread.spreadsheet.Spreadsheet:
+            if not url:
+                if not self.parent._driver:
+                    raise errors.UrlNotFound
+                return self.parent._driver
+            if url not in self._spreadsheets:
+                try:
+                    self._spreadsheets[url] = self.parent._client.open_by_url(url)
+                except gspread.exceptions.NoValidUrlKeyFound:
+                    raise errors.BadUrlFormat
+                except gspread.exceptions.SpreadsheetNotFound:
+                    raise errors.UrlNotFound
+            return self._spreadsheets[url]
+
+        def _target(self, sheet: str, url: Optional[str] = None) -> tuple:
+            """Returns the pending requests of the spreadsheet and the worksheet"""
+            spreadsheet = self._open(url)
+            if spreadsheet.id not in self._worksheets:
+                # one request for all the sheets instead of one per sheet
+                self._worksheets[spreadsheet.id] = {w.title: w for w in spreadsheet.worksheets()}
+                self._pending[spreadsheet.id] = {'spreadsheet': spreadsheet, 'sheets': {}, 'data': [], 'requests': []}
+            worksheet = self._worksheets[spreadsheet.id].get(sheet)
+            if worksheet is None:
+                raise errors.SheetNotFound
+            return self._pending[spreadsheet.id], worksheet
+
+        def write(self, df: pd.DataFrame, sheet: str, url: Optional[str] = None, row: int = 1,
+                  include_index: bool = False, include_column_header: bool = True, clear: bool = True,
+                  resize: bool = True):
+            """Add the dataframe to write to the sheet
+
+            Args:
+                clear (bool): if True, the sheet is cleared before any values of the batch are written
+                resize (bool): if True, the sheet is resized to fit all the writes to it in the batch.
+                    it is only shrunk if it is cleared
+            """
+            pending, worksheet = self._target(sheet, url)
+            values = _df_to_values(df, include_index=include_index, include_column_header=include_column_header)
+            if not values:
+                return self
+            target = pending['sheets'].setdefault(
+                worksheet.id, {'worksheet': worksheet, 'clear': False, 'resize': False, 'rows': 0, 'cols': 0})
+            target['clear'] |= clear
+            target['resize'] |= resize
+            target['rows'] = max(target['rows'], row - 1 + len(values))
+            target['cols'] = max(target['cols'], len(values[0]))
+            pending['data'].append({'range': gspread.utils.absolute_range_name(sheet, f"A{row}"), 'values': values})
+            return self
+
+        def auto_resize(self, cols: list, sheet: str, url: Optional[str] = None):
+            """Add requests to auto resize columns to fit text"""
+            pending, worksheet = self._target(sheet, url)
+            pending['requests'] += _auto_resize_requests(worksheet.id, cols)
+            return self
+
+        def resize(self, col: int, width: int, sheet: str, url: Optional[str] = None):
+            """Add a request to resize columns"""
+            pending, worksheet = self._target(sheet, url)
+            pending['requests'] += _resize_requests(worksheet.id, [col], width)
+            return self
+
+        def freeze(self, sheet: str, rows: Optional[int] = None, cols: Optional[int] = None,
+                   url: Optional[str] = None):
+            """Add a request to freeze rows and/or columns"""
+            pending, worksheet = self._target(sheet, url)
+            pending['requests'].append(_grid_request(worksheet.id, frozen_rows=rows, frozen_cols=cols))
+            return self
+
+        @staticmethod
+        def _flush_spreadsheet(pending: dict):
+            spreadsheet = pending['spreadsheet']
+            before, after = [], []
+            for sheet_id, target in pending['sheets'].items():
+                worksheet = target['worksheet']
+                if target['clear']:
+                    before.append({"updateCells": {"range": {"sheetId": sheet_id}, "fields": "userEnteredValue"}})
+                if worksheet.row_count < target['rows'] or worksheet.col_count < target['cols']:
+                    # values cannot be written outside the grid
+                    before.append(_grid_request(sheet_id, rows=max(target['rows'], worksheet.row_count),
+                                                cols=max(target['cols'], worksheet.col_count)))
+                if target['resize'] and target['clear']:
+                    after.append(_grid_request(sheet_id, rows=target['rows'], cols=target['cols']))
+            after += pending['requests']
+            try:
+                if before:
+                    _call(spreadsheet.batch_update, {'requests': before})
+                if pending['data']:
+                    _call(spreadsheet.values_batch_update,
+                          {'valueInputOption': 'USER_ENTERED', 'data': pending['data']})
+                if after:
+                    _call(spreadsheet.batch_update, {'requests': after})
+            except gspread.exceptions.APIError as e:
+                if 'disabled' in str(e):
+                    raise errors.ApiDisabled
+                elif 'PERMISSION_DENIED' in str(e):
+                    raise errors.BadPermission
+                raise
+            LOGGER.debug(f"flushed {len(pending['data'])} ranges and {len(pending['requests'])} requests "
+                         f"to {spreadsheet.title}")
+
+        def flush(self):
+            """Send the collected writes and requests, each spreadsheet concurrently"""
+            pending = list(self._pending.values())
+            self._pending = {}
+            self._worksheets = {}
+            if not pending:
+                return
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                # list() raises the first error after all the spreadsheets are done
+                list(executor.map(self._flush_spreadsheet, pending))
+
     class Sheet(object):
         def __init__(self, parent):
             """constructor"""
             self.parent = parent
             self._driver: gspread.worksheet.Worksheet = None
             self.cell = self.Cell(self)
+            # column probed for the last row, such as 1 or 'A'. every row of data should have a value in it.
+            # all columns are looked up if None
+            self.key_column: Optional[Union[int, str]] = None
+            # if True, last_row is looked up once and then kept up to date by appends
+            self.track_last_row = False
+            self._last_row = None
 
         def _refresh(self):
             """Rebuild the Gspread client"""
@@ -109,6 +436,7 @@ class MegatonGS(object):
         def clear(self):
             """Blank all the cells on the sheet"""
             self._driver.clear()
+            self._last_row = 0
 
         def create(self, name: str):
             if not self.parent._client:
@@ -121,6 +449,7 @@ class MegatonGS(object):
                 return
             try:
                 self._driver = self.parent._driver.worksheet(name)
+                self._last_row = None
             except gspread.exceptions.WorksheetNotFound:
                 LOGGER.error("Sheet not found.")
                 raise errors.SheetNotFound
@@ -143,15 +472,35 @@ class MegatonGS(object):
 
         @property
         def last_row(self):
-            """looks for the last row based on values appearing in all columns
+            """looks for the last row based on values appearing in all columns, or in key_column if set
+            """
+            if self.track_last_row and self._last_row is not None:
+                return self._last_row
+            self._last_row = self.find_last_row()
+            return self._last_row
+
+        def find_last_row(self, col: Optional[Union[int, str]] = None) -> int:
+            """Looks for the last row with a value, asking the API for the used range
+
+            The values API trims empty rows at the end, so the number of rows returned is the last row.
+
+            Args:
+                col (int or str): column to probe, such as 1 or 'A'. key_column if omitted.
+                    all columns are looked up if neither is set. probing a column that always has
+                    a value in rows of data downloads much less
             """
-            cols = self._driver.range(1, 1, self._driver.row_count, self._driver.col_count)
-            last = [cell.row for cell in cols if cell.value]
-            return max(last) if last else 0
+            col = col or self.key_column
+            if col:
+                letter = gspread.utils.rowcol_to_a1(1, col)[:-1] if isinstance(col, int) else col
+                range_name = gspread.utils.absolute_range_name(self.name, f"{letter}:{letter}")
+            else:
+                range_name = gspread.utils.absolute_range_name(self.name)
+            response = self.parent._driver.values_get(range_name)
+            return len(response.get('values', []))
 
         @property
         def next_available_row(self):
-            """looks for the first empty row based on values appearing in all columns
+            """looks for the first empty row based on values appearing in all columns, or in key_column if set
             """
             return self.last_row + 1
 
@@ -168,58 +517,83 @@ class MegatonGS(object):
             data = self._driver.get_all_records()
             return data
 
+        def read_data(self, columns: Optional[list] = None, ranges: Optional[list] = None,
+                      date_columns: Optional[list] = None, header_row: int = 1) -> pd.DataFrame:
+            """Read the sheet into a DataFrame, fetching only the columns or ranges needed
+
+            Values are read with values.batchGet, unformatted and column by column,
+            so numbers come back as numbers and columns are built without per-row dicts.
+
+            Args:
+                columns (list): header names of the columns to read. all columns if omitted
+                ranges (list): A1 ranges to read instead, such as ['A:C', 'F:F']. the first row is the header
+                date_columns (list): header names of the columns holding dates or datetimes
+                header_row (int): row of the header
+            """
+            if not self._driver:
+                LOGGER.error("Please select a sheet first.")
+                return
+            spreadsheet = self.parent._driver
+            try:
+                if columns:
+                    header = spreadsheet.values_get(
+                        gspread.utils.absolute_range_name(self.name, f"{header_row}:{header_row}"))
+                    names = header.get('values', [[]])[0]
+                    missing = [c for c in columns if c not in names]
+                    if missing:
+                        raise ValueError(f"Columns not found: {missing}")
+                    letters = [gspread.utils.rowcol_to_a1(1, names.index(c) + 1)[:-1] for c in columns]
+                    ranges = [f"{letter}{header_row}:{letter}" for letter in letters]
+                elif not ranges:
+                    ranges = [f"{header_row}:{self._driver.row_count}"]
+                params = {
+                    'majorDimension': 'COLUMNS',
+                    'valueRenderOption': 'UNFORMATTED_VALUE',
+                    'dateTimeRenderOption': 'SERIAL_NUMBER',
+                }
+                response = spreadsheet.values_batch_get(
+                    [gspread.utils.absolute_range_name(self.name, r) for r in ranges], params)
+            except gspread.exceptions.APIError as e:
+                if 'disabled' in str(e):
+                    raise errors.ApiDisabled
+                elif 'PERMISSION_DENIED' in str(e):
+                    raise errors.BadPermission
+                raise
+            data = [c for r in response.get('valueRanges', []) for c in r.get('values', [])]
+            return _columns_to_df(data, date_columns=date_columns)
+
         def auto_resize(self, cols: list):
             """Auto resize columns to fit text"""
-            sheet_id = self.id
-            _requests = []
-            for i in cols:
-                dim = {
-                    "autoResizeDimensions": {
-                        "dimensions": {
-                            "sheetId": sheet_id,
-                            "dimension": "COLUMNS",
-                            "startIndex": i - 1,
-                            "endIndex": i
-                        }
-                    }
-                }
-                _requests.append(dim)
-            self.parent._driver.batch_update({'requests': _requests})
+            self.parent._driver.batch_update({'requests': _auto_resize_requests(self.id, cols)})
 
         def resize(self, col: int, width: int):
             """Resize columns"""
-            sheet_id = self.id
-            _requests = []
-            for i in [col]:
-                dim = {
-                    "updateDimensionProperties": {
-                        "range": {
-                            "sheetId": sheet_id,
-                            "dimension": "COLUMNS",
-                            "startIndex": i - 1,
-                            "endIndex": i
-                        },
-                        "properties": {
-                            "pixelSize": width
-                        },
-                        "fields": "pixelSize"
-                    }
-                }
-                _requests.append(dim)
-            self.parent._driver.batch_update({'requests': _requests})
+            self.parent._driver.batch_update({'requests': _resize_requests(self.id, [col], width)})
 
         def freeze(self, rows: Optional[int] = None, cols: Optional[int] = None):
             """Freeze rows and/or columns on the worksheet"""
             self._driver.freeze(rows=rows, cols=cols)
 
-        def save_data(self, df: pd.DataFrame, mode: str = 'a', row: int = 1, include_index: bool = False):
-            """Save the dataframe to the sheet"""
+        def save_data(self, df: pd.DataFrame, mode: str = 'a', row: int = 1, include_index: bool = False,
+                      fast: bool = False):
+            """Save the dataframe to the sheet
+
+            Args:
+                df (pd.DataFrame): data to save
+                mode (str): 'w' to overwrite, 'a' to append
+                row (int): row to start writing from when overwriting
+                include_index (bool): if True, the index is saved as columns
+                fast (bool): if True, overwrites are sent in chunks through a staging sheet (see write_data)
+                    and appends with values.append (see append_data)
+            """
             if not len(df):
                 LOGGER.info("no data to write.")
                 return
             elif not self._driver:
                 LOGGER.warn("Please select a sheet first.")
                 return
+            elif mode == 'w' and fast:
+                return self.write_data(df, row=row, include_index=include_index)
             elif mode == 'w':
                 try:
                     self.clear()
@@ -237,7 +611,10 @@ class MegatonGS(object):
                     row=row,
                     resize=True
                 )
+                self._last_row = None
                 return True
+            elif mode == 'a' and fast:
+                return self.append_data(df, include_index=include_index)
             elif mode == 'a':
                 next_row = self.next_available_row
                 current_row = self._driver.row_count
@@ -261,8 +638,115 @@ class MegatonGS(object):
                     row=next_row,
                     resize=False
                 )
+                self._last_row = next_row + new_rows - 1
                 return True
 
+        def append_data(self, df: pd.DataFrame, include_index: bool = False,
+                        max_cells: int = MAX_CELLS_PER_REQUEST, max_bytes: int = MAX_BYTES_PER_REQUEST):
+            """Append the dataframe below the data on the sheet with values.append
+
+            The API finds the end of the data and inserts rows for the new values, so one call
+            replaces looking up the last row, adding rows and writing. Large frames are split
+            into chunks under max_cells and max_bytes, and sent in order.
+            """
+            if not len(df):
+                LOGGER.info("no data to write.")
+                return
+            elif not self._driver:
+                LOGGER.warn("Please select a sheet first.")
+                return
+            range_name = gspread.utils.absolute_range_name(self.name)
+            params = {'valueInputOption': 'USER_ENTERED', 'insertDataOption': 'INSERT_ROWS'}
+            for chunk in _iter_chunks(_df_to_values(df, include_index=include_index), max_cells, max_bytes):
+                try:
+                    response = _call(self.parent._driver.values_append, range_name, params, {'values': chunk})
+                except gspread.exceptions.APIError as e:
+                    if 'disabled' in str(e):
+                        raise errors.ApiDisabled
+                    elif 'PERMISSION_DENIED' in str(e):
+                        raise errors.BadPermission
+                    raise
+                updated_range = response.get('updates', {}).get('updatedRange', '')
+                match = re.search(r'(\d+)$', updated_range)
+                if match:
+                    self._last_row = int(match.group(1))
+                LOGGER.debug(f"appended {len(chunk)} rows to {updated_range}")
+            return True
+
+        def write_data(self, df: pd.DataFrame, row: int = 1, include_index: bool = False,
+                       max_cells: int = MAX_CELLS_PER_REQUEST, max_bytes: int = MAX_BYTES_PER_REQUEST,
+                       limiter: RateLimiter = WRITE_LIMITER):
+            """Overwrite the sheet with the dataframe through a staging sheet
+
+            The values are written to a new sheet in chunks under max_cells and max_bytes with
+            values.batchUpdate, throttled by the limiter. Then one batchUpdate resizes and clears
+            the sheet, copies the staging sheet into it and deletes the staging sheet.
+            As the swap is atomic, a failure never leaves the sheet half written, and the sheet
+            keeps its ID and formatting.
+            """
+            if not len(df):
+                LOGGER.info("no data to write.")
+                return
+            elif not self._driver:
+                LOGGER.warn("Please select a sheet first.")
+                return
+            values = _df_to_values(df, include_index=include_index, include_column_header=True)
+            rows = row - 1 + len(values)
+            cols = len(values[0])
+            spreadsheet = self.parent._driver
+            staging = None
+            try:
+                staging = _call(spreadsheet.add_worksheet, f"{self.name}_{uuid.uuid4().hex[:8]}", rows, cols,
+                                limiter=limiter)
+                start = row
+                for chunk in _iter_chunks(values, max_cells, max_bytes):
+                    body = {
+                        'valueInputOption': 'USER_ENTERED',
+                        'data': [{
+                            'range': gspread.utils.absolute_range_name(staging.title, f"A{start}"),
+                            'values': chunk,
+                        }],
+                    }
+                    _call(spreadsheet.values_batch_update, body, limiter=limiter)
+                    LOGGER.debug(f"wrote rows {start} - {start + len(chunk) - 1} to {staging.title}")
+                    start += len(chunk)
+
+                grid = {'startRowIndex': 0, 'endRowIndex': rows, 'startColumnIndex': 0, 'endColumnIndex': cols}
+                _requests = [
+                    _grid_request(self.id, rows=rows, cols=cols),
+                    {
+                        "updateCells": {
+                            "range": {"sheetId": self.id},
+                            "fields": "userEnteredValue"
+                        }
+                    },
+                    {
+                        "copyPaste": {
+                            "source": dict(grid, sheetId=staging.id),
+                            "destination": dict(grid, sheetId=self.id),
+                            "pasteType": "PASTE_FORMULA"
+                        }
+                    },
+                    {
+                        "deleteSheet": {"sheetId": staging.id}
+                    },
+                ]
+                _call(spreadsheet.batch_update, {'requests': _requests}, limiter=limiter)
+                staging = None
+            except gspread.exceptions.APIError as e:
+                if 'disabled' in str(e):
+                    raise errors.ApiDisabled
+                elif 'PERMISSION_DENIED' in str(e):
+                    raise errors.BadPermission
+                raise
+            finally:
+                if staging is not None:
+                    LOGGER.debug(f"deleting {staging.title}")
+                    spreadsheet.del_worksheet(staging)
+            self._refresh()
+            self._last_row = rows
+            return True
+
         def overwrite_data(self, df: pd.DataFrame, include_index: bool = False):
             """Clear the sheet and save the dataframe"""
             return self.save_data(df, mode='w', include_index=include_index)
@@ -1,15 +1,40 @@
 """Functions for Pardot API
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import threading
 
 from pypardot.client import PardotAPI
 import pandas as pd
 
-from . import utils
+from . import pardot_schema, sync, utils
 
 logger = logging.getLogger(__name__)
 
+# Pardot allows up to five concurrent API requests per business unit
+MAX_CONCURRENT_REQUESTS = 5
+
+# Object returned by each query method, to look up its schema
+OBJECTS = {
+    '_query_prospects': 'prospect',
+    '_query_visits_by_prospect_ids': 'visit',
+    '_query_activities': 'visitor_activity',
+    '_query_activities_by_prospect_ids': 'visitor_activity',
+}
+
+# Request budgets shared by every client and thread using the same business unit
+_BUDGETS = {}
+_BUDGETS_LOCK = threading.Lock()
+
+
+def get_request_budget(business_unit_id: str) -> threading.BoundedSemaphore:
+    """Gets the semaphore limiting in-flight requests for a business unit"""
+    with _BUDGETS_LOCK:
+        if business_unit_id not in _BUDGETS:
+            _BUDGETS[business_unit_id] = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+        return _BUDGETS[business_unit_id]
+
 
 class Pardot(object):
     """Class to manage Salesforce Pardot API
@@ -23,19 +48,24 @@ class Pardot(object):
         self.date_from = None
         self.date_to = None
         self.prospect_ids = None
+        self.watermark = None
+        # if True, results are converted with typed columns (see pardot_schema)
+        self.typed = False
         self._client = None
+        self._client_lock = threading.Lock()
 
     @property
     def client(self) -> PardotAPI:
         """Gets or creates an api client"""
-        if self._client is None:
-            self._client = PardotAPI(
-                sf_consumer_key=self.consumer_key,
-                sf_consumer_secret=self.consumer_secret,
-                sf_refresh_token=self.refresh_token,
-                business_unit_id=self.business_unit_id,
-                version=4
-            )
+        with self._client_lock:
+            if self._client is None:
+                self._client = PardotAPI(
+                    sf_consumer_key=self.consumer_key,
+                    sf_consumer_secret=self.consumer_secret,
+                    sf_refresh_token=self.refresh_token,
+                    business_unit_id=self.business_unit_id,
+                    version=4
+                )
         return self._client
 
     def authorize(self, key: str, secret: str, refresh_token: str, bu: str):
@@ -50,60 +80,112 @@ class Pardot(object):
         self.date_from = date1
         self.date_to = date2
 
-    def retry(self, method: str, limit: int = 200, **kwargs) -> pd.DataFrame:
+    def set_watermark(self, store):
+        """Enables incremental sync with high-water marks kept in the store
+
+        Args:
+            store: sync.JsonStore, sync.SqliteStore or sync.GcsStore
+        """
+        self.watermark = sync.HighWaterMark(store)
+        return self
+
+    def _call(self, method: str, **kwargs) -> tuple:
+        """Runs a query method within the request budget of the business unit"""
+        with get_request_budget(self.business_unit_id):
+            return getattr(self, method)(**kwargs)
+
+    def retry(self, method: str, limit: int = 200, workers: int = 1, **kwargs) -> pd.DataFrame:
         """Automatic Paging
 
         Args:
             method (str): method name to run
             limit (int): max number of items to retrieve in a single request
+            workers (int): number of pages to fetch concurrently once the total is known.
+                capped at MAX_CONCURRENT_REQUESTS. defaults to 1 (sequential)
         Returns:
             pd.DataFrame
         """
-        all_rows = []
-        offset = 0
-
-        while True:
-            total, rows = getattr(self, method)(offset=offset, **kwargs)
-            retrieved = len(rows)
-
-            if offset == 0:
-                logger.info(f"Found total {total} rows.")
-
-            if retrieved:
-                num1 = offset + 1
-                num2 = offset + retrieved
-                logger.debug(f"Retrieved rows #{num1} - {num2}.")
-
-            all_rows.extend(rows)
+        total, rows = self._call(method, offset=0, **kwargs)
+        logger.info(f"Found total {total} rows.")
+        if rows:
+            logger.debug(f"Retrieved rows #1 - {len(rows)}.")
+
+        all_rows = list(rows)
+        offsets = list(range(limit, total, limit))
+        workers = max(1, min(workers, MAX_CONCURRENT_REQUESTS))
+
+        def fetch(offset: int) -> list:
+            _, _rows = self._call(method, offset=offset, **kwargs)
+            if _rows:
+                logger.debug(f"Retrieved rows #{offset + 1} - {offset + len(_rows)}.")
+            return _rows
+
+        if len(offsets) > 1 and workers > 1:
+            # map() yields pages in offset order regardless of completion order
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pages = list(executor.map(fetch, offsets))
+        else:
+            pages = [fetch(offset) for offset in offsets]
 
-            if offset + limit < total:
-                # continue the loop
-                offset = offset + limit
-            else:
-                break
+        for _rows in pages:
+            all_rows.extend(_rows)
 
         if not len(all_rows):
             logger.warning("No data found.")
             return pd.DataFrame()
+        elif self.typed and method in OBJECTS:
+            return pardot_schema.records_to_df(all_rows, pardot_schema.SCHEMAS_V4[OBJECTS[method]])
         else:
             return pd.json_normalize(all_rows)
 
-    def loop_by_ids(self, method: str, **kwargs) -> pd.DataFrame:
+    def _retry_incremental(self, object_name: str, column: str, method: str, **kwargs) -> pd.DataFrame:
+        """Runs retry() starting from the high-water mark of the object, then advances the mark
+
+        Args:
+            object_name (str): name of the object the mark is kept for
+            column (str): timestamp column the period is filtered by
+            method (str): method name to run
+        """
+        if not self.watermark:
+            logger.warning("No watermark store is set. Fetching the whole period.")
+            return self.retry(method, **kwargs)
+
+        date_from = self.date_from
+        mark = self.watermark.get(object_name, self.business_unit_id)
+        if sync.mark_is_newer(mark, date_from):
+            logger.info(f"Fetching {object_name} after {mark}.")
+            self.date_from = mark
+        try:
+            df = self.retry(method, **kwargs)
+        finally:
+            self.date_from = date_from
+
+        self.watermark.update(object_name, self.business_unit_id, df, column)
+        return df
+
+    def loop_by_ids(self, method: str, workers: int = 1, **kwargs) -> pd.DataFrame:
         """Loop to execute a method
 
         Args:
             method (str): method name to run
+            workers (int): number of chunks of prospect ids to process concurrently.
+                requests of all chunks share the budget of the business unit
         Returns:
             pd.DataFrame
         """
         df = pd.DataFrame()
         if self.prospect_ids:
             chunked_list = utils.get_chunked_list(self.prospect_ids, chunk_size=300)
-            small_dfs = []
-            for items in chunked_list:
-                prospect_ids = ",".join(items)
-                _df = self.retry(method, prospect_ids=prospect_ids, **kwargs)
-                small_dfs.append(_df)
+
+            def run(items: list) -> pd.DataFrame:
+                return self.retry(method, prospect_ids=",".join(items), **kwargs)
+
+            if len(chunked_list) > 1 and workers > 1:
+                # map() keeps the order of chunks stable
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    small_dfs = list(executor.map(run, chunked_list))
+            else:
+                small_dfs = [run(items) for items in chunked_list]
             df = pd.concat(small_dfs, ignore_index=True)
         else:
             logger.warning("No prospect_ids found.")
@@ -191,10 +273,17 @@ class Pardot(object):
         total = response['total_results']
         return total, rows
 
-    def get_new_prospects(self, fields: str) -> pd.DataFrame:
+    def get_new_prospects(self, fields: str, workers: int = 1, incremental: bool = False) -> pd.DataFrame:
         """Gets active Prospects
+
+        Args:
+            incremental (bool): if True, gets only prospects created after the high-water mark.
+                fields must include created_at.
         """
-        df = self.retry(method='_query_prospects', fields=fields)
+        if incremental:
+            df = self._retry_incremental('prospect', 'created_at', '_query_prospects', workers=workers, fields=fields)
+        else:
+            df = self.retry(method='_query_prospects', workers=workers, fields=fields)
 
         # store prospect ids
         if 'id' in df.columns:
@@ -205,22 +294,34 @@ class Pardot(object):
 
         return df
 
-    def get_visits(self) -> pd.DataFrame:
+    def get_visits(self, workers: int = 1) -> pd.DataFrame:
         """Gets Visits for prospects specified
         """
-        df = self.loop_by_ids(method='_query_visits_by_prospect_ids')
+        df = self.loop_by_ids(method='_query_visits_by_prospect_ids', workers=workers)
 
         return df
 
-    def get_activities(self, by: str = 'updated', type_: str = "1,2,4,6,11,21") -> pd.DataFrame:
+    def get_activities(self,
+                       by: str = 'updated',
+                       type_: str = "1,2,4,6,11,21",
+                       workers: int = 1,
+                       incremental: bool = False
+                       ) -> pd.DataFrame:
         """Gets Visitor Activities
+
+        Args:
+            incremental (bool): if True and by='updated', gets only activities updated after the high-water mark
         """
         if by == 'id':
             # Get Visitor Activities for specific Prospect ID
-            df = self.loop_by_ids(method='_query_activities_by_prospect_ids', type_=type_)
+            df = self.loop_by_ids(method='_query_activities_by_prospect_ids', workers=workers, type_=type_)
         else:
             # Get all Visitor Activities updated after the date time specified
-            df = self.retry(method='_query_activities', type_=type_)
+            if incremental:
+                df = self._retry_incremental('visitor_activity', 'updated_at', '_query_activities',
+                                             workers=workers, type_=type_)
+            else:
+                df = self.retry(method='_query_activities', workers=workers, type_=type_)
 
             # store prospect ids
             if 'prospect_id' in df.columns:
@@ -0,0 +1,331 @@
+"""Asyncio client for Pardot API v5
+
+Same object accessors and set_dates semantics as pardot5.Pardot, but every request is a coroutine:
+
+    async with Pardot(bu, client_id, client_secret, refresh_token=token) as client:
+        df = await client.prospects.query(fields='id,email')
+        async for page in client.visitoractivities.iter_pages(fields='id,type'):
+            ...
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+
+import aiohttp
+import pandas as pd
+
+from . import log, pardot_schema, sync
+from .pardot5 import (BASE_URI, MAX_RECORDS, RETRY_STATUSES, TOKEN_CACHE, BadRequest, CustomRedirects,
+                      PardotAPIError, PartialDataReturned, Prospects, TokenCache, VisitorActivities, Visits,
+                      continue_after, get_retry_delay)
+
+logger = log.Logger(__name__)
+
+
+class Pardot(object):
+    """Asyncio client to manage Salesforce Pardot API
+
+    Args:
+        max_concurrency (int): max number of requests in flight. ignored if semaphore is given
+        semaphore (asyncio.Semaphore): semaphore shared with other clients to cap requests in flight
+        session (aiohttp.ClientSession): session shared with other clients. created if not given
+        token_cache (pardot5.TokenCache): cache of access tokens shared with the blocking client
+    """
+
+    def __init__(self,
+                 business_unit_id: str,
+                 client_id: str,
+                 client_secret: str,
+                 token: str | None = None,
+                 refresh_token: str | None = None,
+                 login_url: str = 'https://login.salesforce.com',
+                 max_concurrency: int = 5,
+                 max_retries: int = 5,
+                 backoff: float = 1.0,
+                 semaphore: asyncio.Semaphore | None = None,
+                 session: aiohttp.ClientSession | None = None,
+                 token_cache: TokenCache | None = TOKEN_CACHE,
+                 typed: bool = False,
+                 ):
+        if not (token or refresh_token):
+            raise BadRequest('Cannot build Authorization header. token or refresh_token is empty')
+        self.business_unit_id = business_unit_id
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token = token
+        self.refresh_token = refresh_token
+        self.token_expires_at = None
+        self.token_cache = token_cache
+        self.login_url = login_url
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_concurrency = max_concurrency
+        self.session = session
+        self._own_session = session is None
+        # asyncio primitives are created in the running loop (see _request)
+        self.semaphore = semaphore
+        self._token_lock = None
+        self.date_from = None
+        self.date_to = None
+        self.watermark = None
+        self.typed = typed
+        self.prospects = Prospects(self)
+        self.visits = Visits(self)
+        self.visitoractivities = VisitorActivities(self)
+        self.customredirects = CustomRedirects(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        """Closes the session if it was created by this client"""
+        if self._own_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    @property
+    def headers(self) -> dict:
+        return {"Authorization": "Bearer " + self.token, "Pardot-Business-Unit-Id": self.business_unit_id}
+
+    def set_dates(self, date1: str, date2: str):
+        """Sets start date and end date"""
+        self.date_from = date1
+        self.date_to = date2
+
+    def set_watermark(self, store):
+        """Enables incremental sync with high-water marks kept in the store"""
+        self.watermark = sync.HighWaterMark(store)
+        return self
+
+    async def _request(self, method: str, url: str, **kwargs) -> tuple:
+        """Sends a request within the semaphore, retrying 429, 5xx, connection errors and timeouts
+
+        Returns:
+            tuple of status code and JSON body
+        """
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        attempt = 0
+        while True:
+            try:
+                async with self.semaphore:
+                    async with self.session.request(method, url, **kwargs) as response:
+                        status = response.status
+                        retry_after = response.headers.get('Retry-After')
+                        try:
+                            body = await response.json(content_type=None)
+                        except (ValueError, aiohttp.ContentTypeError):
+                            # such as an HTML page from a proxy with 502
+                            body = None
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = get_retry_delay(None, attempt, self.backoff)
+                logger.warning(f"{type(e).__name__}: retrying in {delay:.1f} seconds.")
+            else:
+                if status not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return status, body
+                delay = get_retry_delay(retry_after, attempt, self.backoff)
+                logger.warning(f"HTTP {status}: retrying in {delay:.1f} seconds.")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _ensure_token(self, stale_token: str | None = None):
+        """Sets an access token shared by concurrent requests.
+        A cached token is reused. A new one is fetched on first use, before expiry,
+        or when stale_token was rejected and no other request has replaced it yet.
+        """
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            if stale_token and self.token != stale_token:
+                return
+            expiring = self.token_expires_at and self.token_cache \
+                and self.token_expires_at - self.token_cache.margin < time.time()
+            if self.token and not stale_token and not expiring:
+                return
+            if not self.refresh_token:
+                return
+
+            entry = None
+            # the cache may block on file or Secret Manager I/O
+            loop = asyncio.get_running_loop()
+            if self.token_cache and not (stale_token or expiring):
+                entry = await loop.run_in_executor(
+                    None, self.token_cache.get, self.client_id, self.business_unit_id)
+            if entry is None:
+                token = await self.get_token_from_refresh_token(self.refresh_token)
+                if self.token_cache:
+                    # the new token replaces the cached one, so the cache is written once
+                    entry = await loop.run_in_executor(
+                        None, self.token_cache.set, self.client_id, self.business_unit_id, token)
+                else:
+                    entry = {'token': token, 'expires_at': None}
+            self.token = entry['token']
+            self.token_expires_at = entry['expires_at']
+
+    async def get_token_from_refresh_token(self, refresh_token: str) -> str:
+        """refresh tokenからaccess tokenを得る
+        """
+        status, body = await self._request(
+            'POST',
+            self.login_url + '/services/oauth2/token',
+            data={
+                'grant_type': 'refresh_token',
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'refresh_token': refresh_token
+            })
+        body = body if isinstance(body, dict) else {}
+        if status == 200 and body.get('access_token'):
+            return body['access_token']
+        message = f"Refresh Token Error (Salesforce API): {body.get('error')} - {body.get('error_description')}"
+        raise BadRequest(message)
+
+    async def _get_json(self, url: str, params: dict | None = None) -> dict:
+        await self._ensure_token()
+        token = self.token
+        status, body = await self._request('GET', url, headers=self.headers, params=self._encode_params(params))
+        if status == 401 and self.refresh_token:
+            logger.info("Access token was rejected. Refreshing.")
+            await self._ensure_token(stale_token=token)
+            status, body = await self._request('GET', url, headers=self.headers, params=self._encode_params(params))
+        if not isinstance(body, dict):
+            # empty or non-JSON body
+            if status != 200:
+                raise PardotAPIError(json_response={'code': status, 'message': f"HTTP {status}"})
+            return {}
+        if status != 200 and body.get('code'):
+            raise PardotAPIError(json_response=body)
+        return body
+
+    async def _iter_values(self, object_name: str, params: dict | None = None):
+        """Yields the list of values of each page, following nextPageUrl"""
+        response = await self._get_json(self._full_path(object_name), params=params)
+        logger.debug(f"{len(response.get('values'))} {object_name} records were retrieved.")
+        yield response.get('values')
+        while response.get('nextPageUrl'):
+            response = await self._get_json(response['nextPageUrl'])
+            yield response.get('values')
+
+    async def _get_values(self, object_name: str, params: dict | None = None) -> list:
+        """Gets the values of all pages, up to the limit of 100,000 records"""
+        values = []
+        async for page in self._iter_values(object_name, params):
+            values += page
+        return values
+
+    async def get(self, object_name: str, params: dict | None = None) -> pd.DataFrame:
+        """Gets all pages of the object as a DataFrame"""
+        values = await self._get_values(object_name, params)
+
+        if len(values) == MAX_RECORDS:
+            logger.warning("DATA LOSS: The limit of 100,000 records is reached.")
+            raise PartialDataReturned
+        else:
+            logger.debug(f"Total {len(values)} {object_name} records were retrieved.")
+
+        return self._to_frame(object_name, values)
+
+    async def iter_pages(self, object_name: str, params: dict | None = None, as_frame: bool = True):
+        """Yields the results one page at a time, as a DataFrame or a list of dict"""
+        count = 0
+        async for page in self._iter_values(object_name, params):
+            count += len(page)
+            if page:
+                yield self._to_frame(object_name, page) if as_frame else page
+
+        if count == MAX_RECORDS:
+            logger.warning("DATA LOSS: The limit of 100,000 records is reached.")
+            raise PartialDataReturned
+
+    async def iter_records(self, object_name: str, params: dict | None = None):
+        """Yields the results one record (dict) at a time."""
+        async for page in self.iter_pages(object_name, params=params, as_frame=False):
+            for record in page:
+                yield record
+
+    async def get_by_windows(self,
+                             object_name: str,
+                             params: dict | None = None,
+                             field: str = 'updatedAt',
+                             windows: int = 4,
+                             workers: int = 4,
+                             ) -> pd.DataFrame:
+        """Gets records between date_from and date_to beyond the limit of 100,000 records.
+        See pardot5.Pardot.get_by_windows. Requests in flight are capped by the semaphore,
+        workers is accepted for compatibility.
+        """
+        if not (self.date_from and self.date_to):
+            raise BadRequest("Set the period with set_dates first.")
+        start = pd.Timestamp(self.date_from)
+        end = pd.Timestamp(self.date_to)
+        step = (end - start) / max(1, windows)
+        bounds = [start + step * i for i in range(max(1, windows))] + [end]
+
+        async def fetch(window: tuple) -> list:
+            frames = []
+            after = window[0].isoformat()
+            while True:
+                _params = dict(params or {})
+                _params[f'{field}AfterOrEqualTo'] = after
+                _params[f'{field}Before'] = window[1].isoformat()
+                _params['orderBy'] = f'{field} asc'
+                values = await self._get_values(object_name, params=_params)
+                frames.append(self._to_frame(object_name, values))
+                if len(values) < MAX_RECORDS:
+                    return frames
+                after = continue_after(values, field)
+                logger.debug(f"The limit is reached. Continuing {object_name} from {after}")
+
+        results = await asyncio.gather(*[fetch(w) for w in zip(bounds[:-1], bounds[1:])])
+        dfs = [df for part in results for df in part]
+        df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+        if 'id' in df.columns:
+            df = df.drop_duplicates(subset='id', ignore_index=True)
+        return df
+
+    async def get_incremental(self, object_name: str, params: dict | None = None,
+                              field: str = 'updatedAt') -> pd.DataFrame:
+        """Gets records newer than the high-water mark of the object, then advances the mark.
+        See pardot5.Pardot.get_incremental.
+        """
+        if not self.watermark:
+            raise BadRequest("Set a watermark store with set_watermark first.")
+        params = dict(params or {})
+        loop = asyncio.get_running_loop()
+        # stores may block on file or network I/O
+        mark = await loop.run_in_executor(None, self.watermark.get, object_name, self.business_unit_id)
+        if sync.mark_is_newer(mark, self.date_from):
+            params[f'{field}After'] = mark
+        elif self.date_from:
+            params[f'{field}AfterOrEqualTo'] = self.date_from
+        if self.date_to:
+            params[f'{field}Before'] = self.date_to
+
+        df = await self.get(object_name, params=params)
+        await loop.run_in_executor(None, self.watermark.update, object_name, self.business_unit_id, df, field)
+        return df
+
+    def _to_frame(self, object_name: str, values: list) -> pd.DataFrame:
+        if self.typed and object_name in pardot_schema.SCHEMAS_V5:
+            return pardot_schema.records_to_df(values, pardot_schema.SCHEMAS_V5[object_name])
+        return pd.json_normalize(values)
+
+    @staticmethod
+    def _encode_params(params: dict | None) -> dict:
+        """aiohttp accepts only str, int and float as query values"""
+        if not params:
+            return {}
+        return {k: str(v).lower() if isinstance(v, bool) else v for k, v in params.items() if v is not None}
+
+    @staticmethod
+    def _full_path(object_name, version=5):
+        """Builds the full path for the API request"""
+        return f'{BASE_URI}/api/v{version}/objects/{object_name}'
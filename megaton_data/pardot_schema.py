@@ -0,0 +1,170 @@
+"""Typed conversion of Pardot records to DataFrame
+
+pd.json_normalize infers every column row by row and leaves most of them as object dtype.
+For the known objects, columns are built directly from the records into typed arrays:
+IDs to int64, timestamps to datetime64 and activity types to categorical.
+Fields without a type are kept as they are, and nested objects are flattened like json_normalize.
+"""
+from __future__ import annotations
+
+import pandas as pd
+
+INT = 'int'
+FLOAT = 'float'
+BOOL = 'bool'
+DATETIME = 'datetime'
+# API v5 returns timestamps with an UTC offset
+DATETIME_TZ = 'datetime_tz'
+CATEGORY = 'category'
+
+# parsing with a known format is much faster than guessing row by row (pandas >= 2.0)
+_DATETIME_OPTIONS = {'format': 'ISO8601'} if int(pd.__version__.split('.')[0]) >= 2 else {}
+
+# API v4: keyed by object name
+SCHEMAS_V4 = {
+    'prospect': {
+        'id': INT,
+        'score': INT,
+        'created_at': DATETIME,
+        'updated_at': DATETIME,
+        'last_activity_at': DATETIME,
+    },
+    'visit': {
+        'id': INT,
+        'visitor_id': INT,
+        'prospect_id': INT,
+        'visitor_page_view_count': INT,
+        'duration_in_seconds': INT,
+        'first_visitor_page_view_at': DATETIME,
+        'last_visitor_page_view_at': DATETIME,
+        'created_at': DATETIME,
+        'updated_at': DATETIME,
+    },
+    'visitor_activity': {
+        'id': INT,
+        'prospect_id': INT,
+        'visitor_id': INT,
+        'visit_id': INT,
+        'type': CATEGORY,
+        'type_name': CATEGORY,
+        'email_id': INT,
+        'email_template_id': INT,
+        'list_email_id': INT,
+        'form_id': INT,
+        'form_handler_id': INT,
+        'landing_page_id': INT,
+        'file_id': INT,
+        'custom_redirect_id': INT,
+        'created_at': DATETIME,
+        'updated_at': DATETIME,
+    },
+}
+
+# API v5: keyed by the object name in the URL
+SCHEMAS_V5 = {
+    'prospects': {
+        'id': INT,
+        'score': INT,
+        'campaignId': INT,
+        'createdAt': DATETIME_TZ,
+        'updatedAt': DATETIME_TZ,
+        'lastActivityAt': DATETIME_TZ,
+        'isDeleted': BOOL,
+    },
+    'visits': {
+        'id': INT,
+        'visitorId': INT,
+        'prospectId': INT,
+        'visitorPageViewCount': INT,
+        'durationInSeconds': INT,
+        'firstVisitorPageViewAt': DATETIME_TZ,
+        'lastVisitorPageViewAt': DATETIME_TZ,
+        'createdAt': DATETIME_TZ,
+        'updatedAt': DATETIME_TZ,
+    },
+    'visitor-activities': {
+        'id': INT,
+        'prospectId': INT,
+        'visitorId': INT,
+        'visitId': INT,
+        'campaignId': INT,
+        'type': CATEGORY,
+        'typeName': CATEGORY,
+        'emailId': INT,
+        'emailTemplateId': INT,
+        'listEmailId': INT,
+        'formId': INT,
+        'formHandlerId': INT,
+        'landingPageId': INT,
+        'fileId': INT,
+        'customRedirectId': INT,
+        'createdAt': DATETIME_TZ,
+        'updatedAt': DATETIME_TZ,
+    },
+    'custom-redirects': {
+        'id': INT,
+        'campaignId': INT,
+        'folderId': INT,
+        'trackerDomainId': INT,
+        'isDeleted': BOOL,
+        'createdAt': DATETIME_TZ,
+        'updatedAt': DATETIME_TZ,
+    },
+}
+
+
+def _convert(values: list, type_: str):
+    """Converts a list of values into a typed array"""
+    if type_ == INT:
+        series = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce')
+        # int64 unless there are missing values, which only the nullable Int64 can hold
+        return series.astype('int64') if not series.isna().any() else series.astype('Int64')
+    if type_ == FLOAT:
+        return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').astype('float64')
+    if type_ == BOOL:
+        return pd.array(values, dtype='boolean')
+    if type_ in (DATETIME, DATETIME_TZ):
+        return pd.to_datetime(pd.Series(values, dtype=object), errors='coerce', utc=type_ == DATETIME_TZ,
+                              **_DATETIME_OPTIONS)
+    if type_ == CATEGORY:
+        return pd.Categorical(values)
+    return values
+
+
+def records_to_df(records: list, schema: dict, arrow: bool = False):
+    """Converts a list of records (dict) to a typed DataFrame
+
+    Args:
+        records (list): records returned from the API
+        schema (dict): field name -> type. such as SCHEMAS_V5['visitor-activities']
+        arrow (bool): if True, a pyarrow.Table is returned instead
+    Returns:
+        pd.DataFrame or pyarrow.Table
+    """
+    # fields in the order they first appear, like json_normalize
+    fields = {}
+    for record in records:
+        for key in record:
+            if key not in fields:
+                fields[key] = None
+
+    columns = {}
+    nested_columns = {}
+    for key in fields:
+        values = [r.get(key) for r in records]
+        if key in schema:
+            columns[key] = _convert(values, schema[key])
+        elif any(isinstance(v, dict) for v in values):
+            # json_normalize puts flattened columns after the flat ones
+            nested = pd.json_normalize([v if isinstance(v, dict) else {} for v in values])
+            for col in nested.columns:
+                nested_columns[f"{key}.{col}"] = nested[col].values
+        else:
+            columns[key] = values
+    columns.update(nested_columns)
+
+    df = pd.DataFrame(columns, index=pd.RangeIndex(len(records)))
+    if arrow:
+        import pyarrow as pa
+        return pa.Table.from_pandas(df, preserve_index=False)
+    return df
@@ -1,9 +1,11 @@
 """Common helper Pub/Sub functions"""
 import base64
+from concurrent import futures
 import logging
 import os
 
 from google.cloud import pubsub
+from google.cloud.pubsub_v1 import types
 
 PROJECT_ID = os.getenv("GCP_PROJECT")
 LOGGER = logging.getLogger(__name__)
@@ -11,15 +13,34 @@ LOGGER = logging.getLogger(__name__)
 # Reuse GCP Clients across function invocations using globals
 # https://cloud.google.com/functions/docs/bestpractices/tips#use_global_variables_to_reuse_objects_in_future_invocations
 PS_CLIENT = None
+# (batch_settings, publisher_options) the client was built with
+PS_SETTINGS = (None, None)
 
 
-def lazy_client() -> pubsub.PublisherClient:
+def lazy_client(batch_settings: types.BatchSettings = None,
+                publisher_options: types.PublisherOptions = None) -> pubsub.PublisherClient:
     """Returns a Pub/Sub Client that may be shared between cloud function invocations.
+
+    Args:
+        batch_settings (BatchSettings): how messages are batched
+        publisher_options (PublisherOptions): flow control etc.
+            the client is rebuilt only if either is given and differs from those of the current client
     """
-    global PS_CLIENT
+    global PS_CLIENT, PS_SETTINGS
+    settings = (batch_settings, publisher_options)
+    if PS_CLIENT and (batch_settings or publisher_options) and settings != PS_SETTINGS:
+        # sends the messages still batched in the old client
+        PS_CLIENT.stop()
+        PS_CLIENT = None
     if not PS_CLIENT:
         logging.debug("Creating Pub/Sub Client")
-        PS_CLIENT = pubsub.PublisherClient()
+        kwargs = {}
+        if batch_settings:
+            kwargs['batch_settings'] = batch_settings
+        if publisher_options:
+            kwargs['publisher_options'] = publisher_options
+        PS_CLIENT = pubsub.PublisherClient(**kwargs)
+        PS_SETTINGS = settings
     return PS_CLIENT
 
 
@@ -38,6 +59,43 @@ def publish(topic: str, message: str):
         future.result()
 
 
+def publish_many(topic: str, messages: list, timeout: float = None,
+                 batch_settings: types.BatchSettings = None,
+                 publisher_options: types.PublisherOptions = None) -> list:
+    """Publishes messages to a Pub/Sub topic without waiting for each of them.
+
+    The client batches the messages (see BatchSettings) and blocks when too many are
+    outstanding if flow control is configured (see PublisherOptions).
+    All futures are waited for once at the end.
+
+    Args:
+        topic (str): Pub/Sub topic path
+        messages (list): messages (str) to send to Pub/Sub
+        timeout (float): seconds to wait for all messages to be published
+        batch_settings (BatchSettings): passed to lazy_client
+        publisher_options (PublisherOptions): passed to lazy_client
+    Returns:
+        list of message ID (str) or the exception raised, in the order of messages
+    """
+    client = lazy_client(batch_settings=batch_settings, publisher_options=publisher_options)
+    if not topic:
+        return []
+    topic_path = client.topic_path(PROJECT_ID, topic)
+    publish_futures = [client.publish(topic_path, message.encode('utf-8')) for message in messages]
+    futures.wait(publish_futures, timeout=timeout)
+
+    results = []
+    for message, future in zip(messages, publish_futures):
+        try:
+            results.append(future.result(timeout=0))
+        except Exception as e:
+            LOGGER.warning(f"Failed to publish a message to {topic}: {message[:100]} ({e})")
+            results.append(e)
+    failed = sum(isinstance(r, Exception) for r in results)
+    LOGGER.info(f"Published {len(results) - failed} messages to {topic}. {failed} failed.")
+    return results
+
+
 def parse_topic_path(path: str) -> tuple:
     """Parses a topic path into its component segments.
 
@@ -2,6 +2,7 @@ import io
 import logging
 import os
 
+from google.api_core.exceptions import NotFound
 from google.cloud import secretmanager
 from paramiko import RSAKey
 
@@ -33,6 +34,29 @@ class Secret:
         # Return the decoded payload.
         return response.payload.data.decode("UTF-8")
 
+    def add_version(self, secret_id: str, payload: str, destroy_previous: bool = False):
+        """
+        Adds a new version holding the payload to the given secret, which becomes "latest".
+        If destroy_previous is True, the version that was "latest" is destroyed
+        so that versions of a frequently updated secret do not pile up.
+        """
+        client = secretmanager.SecretManagerServiceClient()
+        parent = client.secret_path(self.project_id, secret_id)
+        previous = None
+        if destroy_previous:
+            try:
+                previous = client.get_secret_version(
+                    name=client.secret_version_path(self.project_id, secret_id, 'latest')).name
+            except NotFound:
+                pass
+        response = client.add_secret_version(
+            request={"parent": parent, "payload": {"data": payload.encode("UTF-8")}}
+        )
+        if previous:
+            client.destroy_secret_version(request={"name": previous})
+            LOGGER.debug(f"destroyed {previous}")
+        return response.name
+
     def private_key(self, secret_id: str):
         if secret_id:
             sec = self.text(secret_id).rstrip('\n')
@@ -0,0 +1,134 @@
+"""High-water marks for incremental data sync
+
+A mark is the largest timestamp seen for an object of a business unit.
+The next run asks the API only for records newer than the mark.
+"""
+from __future__ import annotations
+
+from contextlib import closing
+import json
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+from . import log
+
+logger = log.Logger(__name__)
+
+
+class JsonStore(object):
+    """Keeps marks in a local JSON file"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def save(self, marks: dict):
+        # write to a temporary file first so that a crash never leaves a broken file
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(marks, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+class SqliteStore(object):
+    """Keeps marks in a local SQLite database"""
+
+    def __init__(self, path: str, table: str = 'high_water_marks'):
+        self.path = path
+        self.table = table
+        # the connection as a context manager commits but does not close
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value TEXT)")
+
+    def load(self) -> dict:
+        with closing(sqlite3.connect(self.path)) as conn:
+            return dict(conn.execute(f"SELECT key, value FROM {self.table}").fetchall())
+
+    def save(self, marks: dict):
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.executemany(f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)",
+                             list(marks.items()))
+
+
+class GcsStore(object):
+    """Keeps marks in a JSON object on GCS"""
+
+    def __init__(self, bucket_name: str, blob_name: str):
+        self.bucket_name = bucket_name
+        self.blob_name = blob_name
+
+    def load(self) -> dict:
+        # imported here so that local stores work without google-cloud-storage
+        from . import gcs
+        text = gcs.read_text(self.bucket_name, self.blob_name)
+        return json.loads(text) if text else {}
+
+    def save(self, marks: dict):
+        from . import gcs
+        gcs.write_text(self.bucket_name, self.blob_name, json.dumps(marks, indent=2, sort_keys=True),
+                       content_type='application/json')
+
+
+def mark_is_newer(mark: str | None, date_from: str | None) -> bool:
+    """Whether an incremental run starts from the mark rather than date_from.
+    The later of the two wins, so that set_dates can still skip old records.
+    """
+    return bool(mark) and (not date_from or pd.to_datetime(mark, utc=True) > pd.to_datetime(date_from, utc=True))
+
+
+class HighWaterMark(object):
+    """Reads and advances high-water marks kept in a store
+
+    Args:
+        store: JsonStore, SqliteStore, GcsStore or any object with load() and save(dict)
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(object_name: str, business_unit_id: str) -> str:
+        return f"{business_unit_id}/{object_name}"
+
+    def get(self, object_name: str, business_unit_id: str) -> str | None:
+        """Gets the mark of the object, or None for the first run"""
+        return self.store.load().get(self.key(object_name, business_unit_id))
+
+    def update(self, object_name: str, business_unit_id: str, df: pd.DataFrame, column: str) -> str | None:
+        """Advances the mark to the latest value of the column in the dataframe
+
+        The value is kept as returned by the API so that it can be sent back as is.
+        Typed (datetime64) columns are kept in ISO 8601.
+
+        Returns:
+            the mark after the update
+        """
+        key = self.key(object_name, business_unit_id)
+        with self._lock:
+            marks = self.store.load()
+            current = marks.get(key)
+            if not isinstance(df, pd.DataFrame) or column not in df.columns or not len(df):
+                if isinstance(df, pd.DataFrame) and len(df):
+                    logger.warning(f"Column {column} not found. The mark of {key} is not advanced.")
+                return current
+
+            parsed = pd.to_datetime(df[column], errors='coerce', utc=True)
+            if parsed.isna().all():
+                return current
+            latest = df[column].loc[parsed.idxmax()]
+            if current and pd.to_datetime(current, utc=True) >= parsed.max():
+                return current
+
+            marks[key] = latest.isoformat() if isinstance(latest, pd.Timestamp) else str(latest)
+            self.store.save(marks)
+            logger.info(f"The mark of {key} is advanced to {latest}.")
+            return marks[key]